@@ -30,18 +30,44 @@
 #
 ########################################################################
 
+import array
+import collections
+import mmap
+import struct
 import sys
+import winbitmap
+from winfontmodel import Font, FontError, widthbytes as rowbytes
 #import string
 
 # Extract bitmap font data from a Windows .FON or .FNT file.
+#
+# All the parsing below works on memoryviews (of a bytes object or of
+# an mmap of the input file) and reads fields at an offset, so slicing
+# out a resource or a section never copies the rest of the file.
+#
+# The read* and find* functions raise FontFormatError on a font they
+# can't make sense of. The older do*, *fon and *resources functions
+# they back report the error on stderr and return None instead.
+
+class FontFormatError(FontError):
+	"A .FNT or .FON file that can't be read."
+
+def quietly(fn, *args):
+	"""Call fn; if it raises FontFormatError, report the error on stderr
+	and return None."""
+	try:
+		return fn(*args)
+	except FontFormatError as e:
+		sys.stderr.write(str(e)+"\n")
+		return None
 
-def frombyte(s):
+def frombyte(s, off=0):
 	#return ord(s[0])
-	return s[0]
-def fromword(s):
-	return frombyte(s[0:1]) + 256 * frombyte(s[1:2])
-def fromdword(s):
-	return fromword(s[0:2]) | (fromword(s[2:4]) << 16)
+	return s[off]
+def fromword(s, off=0):
+	return struct.unpack_from("<H", s, off)[0]
+def fromdword(s, off=0):
+	return struct.unpack_from("<L", s, off)[0]
 
 def asciz(s):
 	#i = string.find(s, "\0")
@@ -50,84 +76,120 @@ def asciz(s):
 		s = s[:i]
 	return s
 
+def ascizat(s, off):
+	"Return the NUL-terminated string starting at an offset in a buffer."
+	end = off
+	while end < len(s) and s[end] != 0:
+		end = end + 1
+	return bytes(s[off:end])
+
 def bool(n):
 	if n:
 		return "yes"
 	else:
 		return "no"
 
-class font:
-	pass
-
-class char:
-	pass
-
-def savefont(f, file):
-	"Write out a .fd form of an internal font description."
-	file.write("# .fd font description generated by dewinfont.\n\n")
-	file.write("facename " + f.facename + "\n")
-	file.write("copyright " + f.copyright + "\n\n")
-	#if f.height == f.pointsize: file.write("# ")
-	file.write("pointsize " + "%d"%f.pointsize + "\n\n")
-	file.write("height " + "%d"%f.height + "\n")
-	file.write("ascent " + "%d"%f.ascent + "\n")
-	file.write("inleading " + "%d"%f.inleading + "\n")
-	file.write("exleading " + "%d"%f.exleading + "\n\n")
-	if not f.italic: file.write("# ")
-	file.write("italic " + bool(f.italic) + "\n")
-	if not f.underline: file.write("# ")
-	file.write("underline " + bool(f.underline) + "\n")
-	if not f.strikeout: file.write("# ")
-	file.write("strikeout " + bool(f.strikeout) + "\n")
-	if f.weight == 400: file.write("# ")
-	file.write("weight " + "%d"%f.weight + "\n\n")
-	if f.charset == 0: file.write("# ")
-	file.write("charset " + "%d"%f.charset + "\n\n")
+# The eight pixels of each possible bitmap byte, as .fd text.
+fdbyte = ["".join([".x"[(b >> (7-k)) & 1] for k in range(8)])
+	for b in range(256)]
+
+def fdheader(f):
+	"Return the .fd text for the header fields of a font."
+	out = []
+	out.append("# .fd font description generated by dewinfont.\n\n")
+	out.append("facename " + f.facename + "\n")
+	out.append("copyright " + f.copyright + "\n\n")
+	#if f.height == f.pointsize: out.append("# ")
+	out.append("pointsize " + "%d"%f.pointsize + "\n\n")
+	out.append("height " + "%d"%f.height + "\n")
+	out.append("ascent " + "%d"%f.ascent + "\n")
+	out.append("inleading " + "%d"%f.inleading + "\n")
+	out.append("exleading " + "%d"%f.exleading + "\n\n")
+	if not f.italic: out.append("# ")
+	out.append("italic " + bool(f.italic) + "\n")
+	if not f.underline: out.append("# ")
+	out.append("underline " + bool(f.underline) + "\n")
+	if not f.strikeout: out.append("# ")
+	out.append("strikeout " + bool(f.strikeout) + "\n")
+	if f.weight == 400: out.append("# ")
+	out.append("weight " + "%d"%f.weight + "\n\n")
+	if f.charset == 0: out.append("# ")
+	out.append("charset " + "%d"%f.charset + "\n\n")
+	return "".join(out)
+
+def fdglyph(f, i):
+	"Return the .fd text for char i of a font."
+	width = f.widths[i]
+	text = "char " + "%d"%i + "\nwidth " + "%d"%width + "\n"
+	if width == 0:
+		return text + "\n"
+	# Expand the glyph's store bytes to pixels in one go, then cut each
+	# row out of that at the stride.
+	size = f.glyphsize
+	pixels = "".join(map(fdbyte.__getitem__, f.bits[i*size:(i+1)*size]))
+	step = 8 * f.stride
+	rows = [pixels[p:p+width] for p in range(0, len(pixels), step)]
+	rows.append("")
+	return text + "\n".join(rows) + "\n"
+
+def fdchunks(f):
+	"Generate the .fd text of a font: the header, then one chunk per char."
+	yield fdheader(f)
 	for i in range(256):
-		file.write("char " + "%d"%i + "\nwidth " + "%d"%f.chars[i].width+"\n")
-		if f.chars[i].width != 0:
-			for j in range(f.height):
-				v = f.chars[i].data[j]
-				m = 1 << (f.chars[i].width-1)
-				for k in range(f.chars[i].width):
-					if v & m:
-						file.write("x") #"1")
-					else:
-						file.write(".") #"0")
-					v = v << 1
-				file.write("\n")
-		file.write("\n")
+		yield fdglyph(f, i)
+
+def savefont(f, file, stream=0):
+	"""Write out a .fd form of an internal font description to any
+	object with a write method. The text goes out in one write, or in
+	one write per char if stream is set."""
+	if stream:
+		for chunk in fdchunks(f):
+			file.write(chunk)
+	else:
+		file.write("".join(fdchunks(f)))
 
 def dofnt(fnt):
 	"Create an internal font description from a .FNT-shaped string."
-	f = font()
-	f.chars = [None] * 256
-	version = fromword(fnt[0:])
-	ftype = fromword(fnt[0x42:])
+	return quietly(readfnt, fnt)
+
+def readfnt(fnt, chars=None):
+	"""Create an internal font description from a .FNT-shaped string.
+	If chars is given (any iterable of char codes, such as a set or a
+	range), only those chars' glyphs are decoded, and the rest are
+	left with zero width. Raises FontFormatError if it can't be read."""
+	try:
+		return fntfont(memoryview(fnt), chars)
+	except (struct.error, IndexError):
+		raise FontFormatError("Font data truncated")
+
+def fntfont(fnt, chars=None):
+	f = Font()
+	version = fromword(fnt, 0)
+	ftype = fromword(fnt, 0x42)
 	if ftype & 1:
-		sys.stderr.write("This font is a vector font\n")
-		return None
-	off_facename = fromdword(fnt[0x69:])
+		raise FontFormatError("This font is a vector font")
+	off_facename = fromdword(fnt, 0x69)
 	if off_facename < 0 or off_facename > len(fnt):
-		sys.stderr.write("Face name not contained within font data")
-		return None
-	f.facename = str(asciz(fnt[off_facename:]), encoding="windows-1252")
+		raise FontFormatError("Face name not contained within font data")
+	f.facename = str(ascizat(fnt, off_facename), encoding="windows-1252",
+		errors="replace")
 	#print "Face name", f.facename
-	f.copyright = str(asciz(fnt[6:66] + b"\0"), encoding="windows-1252")
+	f.copyright = str(asciz(bytes(fnt[6:66])), encoding="windows-1252",
+		errors="replace")
 	#print "Copyright", f.copyright
-	f.pointsize = fromword(fnt[0x44:])
+	f.pointsize = fromword(fnt, 0x44)
 	#print "Point size", f.pointsize
-	f.ascent = fromword(fnt[0x4A:])
+	f.ascent = fromword(fnt, 0x4A)
 	#print "Ascent", f.ascent
-	f.inleading = fromword(fnt[0x4C:])
-	f.exleading = fromword(fnt[0x4E:])
-	f.height = fromword(fnt[0x58:])
+	f.inleading = fromword(fnt, 0x4C)
+	f.exleading = fromword(fnt, 0x4E)
+	f.height = fromword(fnt, 0x58)
 	#print "Height", f.height
-	f.italic = frombyte(fnt[0x50:]) != 0
-	f.underline = frombyte(fnt[0x51:]) != 0
-	f.strikeout = frombyte(fnt[0x52:]) != 0
-	f.weight = fromword(fnt[0x53:])
-	f.charset = frombyte(fnt[0x55:])
+	f.italic = frombyte(fnt, 0x50) != 0
+	f.underline = frombyte(fnt, 0x51) != 0
+	f.strikeout = frombyte(fnt, 0x52) != 0
+	f.weight = fromword(fnt, 0x53)
+	f.charset = frombyte(fnt, 0x55)
 	#print "Attrs", f.italic, f.underline, f.strikeout, f.weight
 	#print "Charset", f.charset
 	# Read the char table.
@@ -137,150 +199,286 @@ def dofnt(fnt):
 	else:
 		ctstart = 0x94
 		ctsize = 6
-	maxwidth = 0
-	for i in range(256):
-		f.chars[i] = char()
-		f.chars[i].width = 0
-		f.chars[i].data = [0] * f.height
-	firstchar = frombyte(fnt[0x5F:])
-	lastchar = frombyte(fnt[0x60:])
-	for i in range(firstchar,lastchar+1):
+	firstchar = frombyte(fnt, 0x5F)
+	lastchar = frombyte(fnt, 0x60)
+	if chars != None:
+		wanted = sorted(set([i for i in chars if firstchar <= i <= lastchar]))
+	else:
+		if fromword(fnt, 0x56) != 0 and lastchar >= firstchar:
+			f = dofixed(f, fnt, ctstart, ctsize, firstchar, lastchar)
+			if f.stride != 0:
+				return f
+		wanted = range(firstchar, lastchar+1)
+	# Collect the char table first, grouping chars by how many byte
+	# columns they occupy, so each group's bitmaps can be transposed
+	# in one batch.
+	widths = [0] * 256
+	groups = {}
+	for i in wanted:
 		entry = ctstart + ctsize * (i-firstchar)
-		w = fromword(fnt[entry:])
-		f.chars[i].width = w
+		w = fromword(fnt, entry)
+		widths[i] = w
 		if ctsize == 4:
-			off = fromword(fnt[entry+2:])
+			off = fromword(fnt, entry+2)
 		else:
-			off = fromdword(fnt[entry+2:])
+			off = fromdword(fnt, entry+2)
 		#print "Char", i, "width", w, "offset", off, "filelen", len(fnt)
 		#widthbytes = (w + 7) / 8
 		widthbytes = (w + 7) // 8
-		for j in range(f.height):
-			for k in range(widthbytes):
-				bytepos = off + k * f.height + j
-				#print bytepos, "->", hex(frombyte(fnt[bytepos:]))
-				f.chars[i].data[j] = f.chars[i].data[j] << 8
-				f.chars[i].data[j] = f.chars[i].data[j] | frombyte(fnt[bytepos:])
-			f.chars[i].data[j] = f.chars[i].data[j] >> (8*widthbytes - w)
+		if widthbytes:
+			# Check the bitmap is there before sizing the store from
+			# the widths and height, which could be anything.
+			if off + widthbytes * f.height > len(fnt):
+				raise FontFormatError("Font data truncated")
+			groups.setdefault(widthbytes, []).append((i, off))
+	f.reset(f.height, rowbytes(max(widths)))
+	f.widths[:] = array.array("H", widths)
+	stride = f.stride
+	size = f.glyphsize
+	for widthbytes, members in groups.items():
+		rows = winbitmap.colstorows(fnt, [off for i, off in members],
+			f.height, widthbytes)
+		rows = winbitmap.restride(rows, len(members) * f.height,
+			widthbytes, stride)
+		for n in range(len(members)):
+			i = members[n][0]
+			f.bits[i*size:(i+1)*size] = rows[n*size:(n+1)*size]
+			if widths[i] % 8:
+				f.clip(i)
+	return f
+
+def dofixed(f, fnt, ctstart, ctsize, firstchar, lastchar):
+	"""Read the glyphs of a font whose header says it is fixed-pitch.
+	If the char table really does give every char that width, with the
+	bitmaps evenly spaced, they are transposed as one block without
+	looking at each char; otherwise f is returned with a zero stride."""
+	width = fromword(fnt, 0x56)
+	n = lastchar - firstchar + 1
+	if ctsize == 4:
+		entry = "HH"
+		start = fromword(fnt, ctstart+2)
+		second = fromword(fnt, ctstart+ctsize+2)
+	else:
+		entry = "HL"
+		start = fromdword(fnt, ctstart+2)
+		second = fromdword(fnt, ctstart+ctsize+2)
+	# Writers may pad each bitmap with blank columns (mkwinfont rounds
+	# to an even number), so take the spacing from the table and treat
+	# the padding as part of each glyph.
+	if n > 1:
+		spacing = second - start
+	else:
+		spacing = f.height * ((width + 7) // 8)
+	if f.height == 0 or spacing == 0 or spacing % f.height or \
+		spacing < f.height * ((width + 7) // 8) or \
+		start + n*spacing > len(fnt):
+		return f
+	# The char table we expect, built in one go and compared whole.
+	entries = [0] * (2*n)
+	entries[0::2] = [width] * n
+	entries[1::2] = range(start, start + n*spacing, spacing)
+	try:
+		expect = struct.pack("<" + entry * n, *entries)
+	except struct.error:
+		return f
+	if fnt[ctstart:ctstart+len(expect)] != expect:
+		return f
+	columns = spacing // f.height
+	f.reset(f.height, rowbytes(width))
+	f.widths[firstchar:lastchar+1] = array.array("H", [width] * n)
+	rows = winbitmap.blocktorows(fnt, start, n, f.height, columns)
+	rows = winbitmap.restride(rows, n * f.height, columns, f.stride)
+	f.bits[firstchar*f.glyphsize:(lastchar+1)*f.glyphsize] = rows
+	if width % 8 or columns > (width + 7) // 8:
+		f.clipall(width)
 	return f
 
 def nefon(fon, neoff):
 	"Finish splitting up a NE-format FON file."
+	return quietly(lambda: readfnts(fon, findne(fon, neoff)))
+
+def pefon(fon, peoff):
+	"Finish splitting up a PE-format FON file."
+	return quietly(lambda: readfnts(fon, findpe(fon, peoff)))
+
+def readfnts(fon, resources, chars=None):
+	"""Decode each (offset, size) font resource in a .FON (only the
+	glyphs for chars, if that is given, as readfnt does). Raises
+	FontFormatError if any can't be read."""
+	fon = memoryview(fon)
+	ret = []
+	for start, size in resources:
+		try:
+			font = readfnt(fon[start:start+size], chars)
+		except FontFormatError as e:
+			raise FontFormatError("Failed to read font resource at %x: %s" %
+				(start, e))
+		ret = ret + [font]
+	return ret
+
+def findne(fon, neoff):
+	"""Find the font resources in a NE-format FON file, as a list of
+	(offset, size) pairs. Raises FontFormatError if it can't."""
+	try:
+		return nerestable(memoryview(fon), neoff)
+	except (struct.error, IndexError):
+		raise FontFormatError("Resource table truncated")
+
+def nerestable(fon, neoff):
 	ret = []
 	# Find the resource table.
-	rtable = fromword(fon[neoff + 0x24:])
+	rtable = fromword(fon, neoff + 0x24)
 	rtable = rtable + neoff
 	# Read the shift count out of the resource table.
-	shift = fromword(fon[rtable:])
+	shift = fromword(fon, rtable)
 	# Now loop over the rest of the resource table.
 	p = rtable+2
 	while 1:
-		rtype = fromword(fon[p:])
+		rtype = fromword(fon, p)
 		if rtype == 0:
 			break  # end of resource table
-		count = fromword(fon[p+2:])
+		count = fromword(fon, p+2)
 		p = p + 8  # type, count, 4 bytes reserved
 		for i in range(count):
-			start = fromword(fon[p:]) << shift
-			size = fromword(fon[p+2:]) << shift
+			start = fromword(fon, p) << shift
+			size = fromword(fon, p+2) << shift
 			if start < 0 or size < 0 or start+size > len(fon):
-				sys.stderr.write("Resource overruns file boundaries\n")
-				return None
+				raise FontFormatError("Resource overruns file boundaries")
 			if rtype == 0x8008: # this is an actual font
 				#print "Font at", start, "size", size
-				font = dofnt(fon[start:start+size])
-				if font == None:
-					sys.stderr.write("Failed to read font resource at %x" \
-					% start)
-					return None
-				ret = ret + [font]
+				ret.append((start, size))
 			p = p + 12 # start, size, flags, name/id, 4 bytes reserved
 	return ret
 
-def pefon(fon, peoff):
-	"Finish splitting up a PE-format FON file."
-	dirtables=[]
-	dataentries=[]
-	def gotoffset(off,dirtables=dirtables,dataentries=dataentries):
-		if off & 0x80000000:
-			off = off &~ 0x80000000
-			dirtables.append(off)
-		else:
-			dataentries.append(off)
-	def dodirtable(rsrc, off, rtype, gotoffset=gotoffset):
-		number = fromword(rsrc[off+12:]) + fromword(rsrc[off+14:])
-		for i in range(number):
-			entry = off + 16 + 8*i
-			thetype = fromdword(rsrc[entry:])
-			theoff = fromdword(rsrc[entry+4:])
-			if rtype == -1 or rtype == thetype:
-				gotoffset(theoff)
+def findpe(fon, peoff, maxdepth=None, maxentries=None):
+	"""Find the font resources in a PE-format FON file, as a list of
+	(offset, size) pairs. Raises FontFormatError if it can't, or if
+	its resource directories nest deeper than maxdepth or hold more
+	than maxentries entries in all (pemaxdepth and pemaxentries by
+	default)."""
+	try:
+		return perestable(memoryview(fon), peoff, maxdepth, maxentries)
+	except (struct.error, IndexError):
+		raise FontFormatError("Resource directory truncated")
+
+# Limits on the resource directory tree of a PE-format FON. A real one
+# is three levels deep (type, name, language) with a few entries per
+# font; these just stop a malformed or hostile file from making the
+# walk take forever.
+pemaxdepth = 8
+pemaxentries = 1 << 16
+
+# A section table entry: name, virtual size, RVA, raw size and file
+# offset of the raw data.
+pesection = struct.Struct("<8sLLLL")
+# A resource directory entry: name or ID, and the offset of a table or
+# data entry.
+pedirentry = struct.Struct("<LL")
+
+def pesections(fon, peoff):
+	"""Return the sections of a PE file as a list of (name, rva, vsize,
+	rawsize, offset) tuples, in section table order."""
+	secentries = fromword(fon, peoff+0x06)
+	sectable = peoff + 0x18 + fromword(fon, peoff+0x14)
+	ret = []
+	for i in range(secentries):
+		name, vsize, rva, rawsize, ptr = pesection.unpack_from(fon,
+			sectable + i * 0x28)
+		ret.append((asciz(name), rva, vsize, rawsize, ptr))
+	return ret
+
+def rvaoffset(sections, rva):
+	"Map an RVA to a file offset, through whichever section holds it."
+	for name, secrva, vsize, rawsize, ptr in sections:
+		if secrva <= rva < secrva + max(vsize, rawsize):
+			return ptr + rva - secrva
+	raise FontFormatError("Resource data at RVA %x not in any section" % rva)
 
+def perestable(fon, peoff, maxdepth=None, maxentries=None):
+	if maxdepth == None:
+		maxdepth = pemaxdepth
+	if maxentries == None:
+		maxentries = pemaxentries
 	# We could try finding the Resource Table entry in the Optional
 	# Header, but it talks about RVAs instead of file offsets, so
 	# it's probably easiest just to go straight to the section table.
-	# So let's find the size of the Optional Header, which we can
-	# then skip over to find the section table.
-	secentries = fromword(fon[peoff+0x06:])
-	sectable = peoff + 0x18 + fromword(fon[peoff+0x14:])
-	for i in range(secentries):
-		secentry = sectable + i * 0x28
-		secname = asciz(fon[secentry:secentry+8])
-		secrva = fromdword(fon[secentry+0x0C:])
-		secsize = fromdword(fon[secentry+0x10:])
-		secptr = fromdword(fon[secentry+0x14:])
+	sections = pesections(fon, peoff)
+	for secname, secrva, secvsize, secsize, secptr in sections:
 		if secname == b".rsrc":
 			break
-	if secname != b".rsrc":
-		sys.stderr.write("Unable to locate resource section\n")
-		return None
-	# Now we've found the resource section, let's throw away the rest.
+	else:
+		raise FontFormatError("Unable to locate resource section")
+	# Now we've found the resource section, let's look only at that.
 	rsrc = fon[secptr:secptr+secsize]
 
-	# Now the fun begins. To start with, we must find the initial
-	# Resource Directory Table and look up type 0x08 (font) in it.
-	# If it yields another Resource Directory Table, we stick the
-	# address of that on a list. If it gives a Data Entry, we put
-	# that in another list.
-	dodirtable(rsrc, 0, 0x08)
-	# Now process Resource Directory Tables until no more remain
-	# in the list. For each of these tables, we accept _all_ entries
-	# in it, and if they point to subtables we stick the subtables in
-	# the list, and if they point to Data Entries we put those in
-	# the other list.
-	while len(dirtables) > 0:
-		table = dirtables[0]
-		del dirtables[0]
-		dodirtable(rsrc, table, -1) # accept all entries
-	# Now we should be left with Resource Data Entries. Each of these
-	# describes a font.
+	# Walk the Resource Directory Tables breadth first. In the root we
+	# want only the type 0x08 (font) entry; below that, every entry.
+	# An entry with the top bit set points to another table, which is
+	# queued unless it has been seen before; any other entry points to
+	# a Resource Data Entry, which describes a font.
+	dataentries = []
+	visited = set([0])
+	queue = collections.deque([(0, 0)])
+	nentries = 0
+	while queue:
+		off, depth = queue.popleft()
+		number = fromword(rsrc, off+12) + fromword(rsrc, off+14)
+		nentries = nentries + number
+		if nentries > maxentries:
+			raise FontFormatError("Too many resource directory entries")
+		if off + 16 + 8*number > len(rsrc):
+			raise FontFormatError("Resource directory truncated")
+		for thetype, theoff in pedirentry.iter_unpack(
+			rsrc[off+16:off+16+8*number]):
+			if depth == 0 and thetype != 0x08:
+				continue
+			if theoff & 0x80000000:
+				theoff = theoff &~ 0x80000000
+				if theoff in visited:
+					continue
+				if depth + 1 >= maxdepth:
+					raise FontFormatError("Resource directory too deep")
+				visited.add(theoff)
+				queue.append((theoff, depth + 1))
+			else:
+				dataentries.append(theoff)
 	ret = []
 	for off in dataentries:
-		rva = fromdword(rsrc[off:])
-		start = rva - secrva
-		size = fromdword(rsrc[off+4:])
-		font = dofnt(rsrc[start:start+size])
-		if font == None:
-			sys.stderr.write("Failed to read font resource at %x" % start)
-			return None
-		ret = ret + [font]
+		rva = fromdword(rsrc, off)
+		size = fromdword(rsrc, off+4)
+		start = rvaoffset(sections, rva)
+		if start + size > len(fon):
+			raise FontFormatError("Resource overruns file boundaries")
+		ret.append((start, size))
 	return ret
 
 def dofon(fon):
 	"Split a .FON up into .FNTs and pass each to dofnt."
+	return quietly(readfon, fon)
+
+def readfon(fon, chars=None):
+	"""Split a .FON up into .FNTs and decode each (only the glyphs for
+	chars, if that is given). Raises FontFormatError if it can't be
+	read."""
+	return readfnts(fon, findfonts(fon), chars)
+
+def findfonts(fon):
+	"""Find the font resources in a .FON, as a list of (offset, size)
+	pairs. Raises FontFormatError if it isn't a .FON we understand."""
+	fon = memoryview(fon)
 	# Check the MZ header.
 	if fon[0:2] != b"MZ":
-		sys.stderr.write("MZ signature not found\n")
-		return None
+		raise FontFormatError("MZ signature not found")
 	# Find the NE header.
-	neoff = fromdword(fon[0x3C:])
+	if len(fon) < 0x40:
+		raise FontFormatError("MZ header truncated")
+	neoff = fromdword(fon, 0x3C)
 	if fon[neoff:neoff+2] == b"NE":
-		return nefon(fon, neoff)
+		return findne(fon, neoff)
 	elif fon[neoff:neoff+4] == b"PE\0\0":
-		return pefon(fon, neoff)
+		return findpe(fon, neoff)
 	else:
-		sys.stderr.write("NE or PE signature not found\n")
-		return None
+		raise FontFormatError("NE or PE signature not found")
 
 def isfon(data):
 	"Determine if a file is a .FON or a .FNT format font."
@@ -289,15 +487,14 @@ def isfon(data):
 	else:
 		return 0 # FNT
 
-if __name__ == "__main__":
-	a = sys.argv[1:]
+def parseargs(a):
+	"""Parse a dewinfont command line. Returns (outfile, prefix, infile,
+	packed); raises ValueError if it makes no sense."""
 	options = 1
 	outfile = None
 	prefix = None
 	infile = None
-	if len(a) == 0:
-		print("usage: dewinfont [-o outfile | -p prefix] file")
-		sys.exit(0)
+	packed = 0
 	while len(a) > 0:
 		if a[0] == "--":
 			options = 0
@@ -308,46 +505,103 @@ if __name__ == "__main__":
 					outfile = a[1]
 					a = a[2:]
 				except IndexError:
-					sys.stderr.write("option -o requires an argument\n")
-					sys.exit(1)
+					raise ValueError("option -o requires an argument")
 			elif a[0] == "-p":
 				try:
 					prefix = a[1]
 					a = a[2:]
 				except IndexError:
-					sys.stderr.write("option -p requires an argument\n")
-					sys.exit(1)
+					raise ValueError("option -p requires an argument")
+			elif a[0] == "-fdb":
+				packed = 1
+				a = a[1:]
 			else:
 				sys.stderr.write("ignoring unrecognised option "+a[0]+"\n")
 				a = a[1:]
 		else:
 			if infile != None:
-				sys.stderr.write("one input file at once, please\n")
-				sys.exit(1)
+				raise ValueError("one input file at once, please")
 			infile = a[0]
 			a = a[1:]
+	if infile == None:
+		raise ValueError("no input file specified")
+	return outfile, prefix, infile, packed
 
+def readfile(infile):
+	"Map (or, failing that, read) a font file into memory."
 	fp = open(infile, "rb")
-	data = fp.read()
+	try:
+		data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+	except (ValueError, OSError):
+		data = fp.read() # empty files, pipes and devices can't be mapped
 	fp.close()
+	return data
 
+def decompile(data):
+	"Decode every font in a .FON or .FNT file, or return None on failure."
+	return quietly(readfonts, data)
+
+def readfonts(data, chars=None):
+	"""Decode every font in a .FON or .FNT file, or with chars just
+	those chars' glyphs of every font. Raises FontFormatError on
+	failure."""
 	if isfon(data):
-		fonts = dofon(data)
-	else:
-		fonts = [dofnt(data)]
+		return readfon(data, chars)
+	return [readfnt(data, chars)]
 
-	if len(fonts) > 1 and prefix == None:
-		sys.stderr.write("more than one font in file; use -p prefix\n")
-		sys.exit(1)
+def outnames(n, outfile, prefix, ext=".fd"):
+	"""Return the .fd (or other ext) file names to write n fonts to,
+	given -o and -p. Raises ValueError if they aren't enough."""
+	if n > 1 and prefix == None:
+		raise ValueError("more than one font in file; use -p prefix")
 	if outfile == None and prefix == None:
-		sys.stderr.write("please specify -o outfile or -p prefix\n")
+		raise ValueError("please specify -o outfile or -p prefix")
+	if n == 1 and outfile != None:
+		return [outfile]
+	return [prefix + "%02d"%i + ext for i in range(n)]
+
+if __name__ == "__main__":
+	if len(sys.argv) == 1:
+		print("usage: dewinfont [-profile] [-pstats file] [-fdb] [-o outfile | -p prefix] file")
+		sys.exit(0)
+	args = sys.argv[1:]
+	if set(args) & set(["-profile", "--profile", "-pstats"]):
+		import winfontprof
+		try:
+			args = winfontprof.fromargs(args, sys.modules[__name__])
+		except ValueError as e:
+			sys.stderr.write(str(e)+"\n")
+			sys.exit(1)
+	try:
+		outfile, prefix, infile, packed = parseargs(args)
+	except ValueError as e:
+		sys.stderr.write(str(e)+"\n")
 		sys.exit(1)
 
-	for i in range(len(fonts)):
-		if len(fonts) == 1 and outfile != None:
-			fname = outfile
-		else:
-			fname = prefix + "%02d"%i + ".fd"
-		fp = open(fname, "w")
-		savefont(fonts[i], fp)
-		fp.close()
+	try:
+		fonts = decompile(readfile(infile))
+	except OSError as e:
+		sys.stderr.write(str(e)+"\n")
+		sys.exit(1)
+	if fonts == None:
+		sys.stderr.write("unable to read fonts from "+infile+"\n")
+		sys.exit(1)
+	try:
+		fnames = outnames(len(fonts), outfile, prefix,
+			".fdb" if packed else ".fd")
+	except ValueError as e:
+		sys.stderr.write(str(e)+"\n")
+		sys.exit(1)
+
+	try:
+		for i in range(len(fonts)):
+			if packed:
+				import winfontpack
+				winfontpack.savefile(fonts[i], fnames[i])
+				continue
+			fp = open(fnames[i], "w")
+			savefont(fonts[i], fp)
+			fp.close()
+	except OSError as e:
+		sys.stderr.write(str(e)+"\n")
+		sys.exit(1)
@@ -30,7 +30,16 @@
 #
 ########################################################################
 
+import array
+import hashlib
+import os
+import re
+import struct
 import sys
+import tempfile
+import winbitmap
+import winfontpack
+from winfontmodel import Font, FontError, widthbytes as rowbytes
 #import string
 
 # Generate Windows bitmap font files from a text description.
@@ -57,237 +66,485 @@ def asciz(s):
 		s = s[:i]
 	return s
 
-class font:
-	pass
+class FDError(FontError):
+	"A syntax or consistency error in a .fd font description."
+	def __init__(self, msg, lineno=None, col=None, filename=None):
+		FontError.__init__(self, msg)
+		self.msg = msg
+		self.lineno = lineno
+		self.col = col
+		self.filename = filename
 
-class char:
-	pass
+	def __str__(self):
+		where = ""
+		if self.filename != None:
+			where = self.filename + ": "
+		if self.lineno != None:
+			where = where + "line %d: " % self.lineno
+			if self.col != None:
+				where = where[:-2] + ", column %d: " % self.col
+		return where + self.msg
 
-def loadfont(file):
-	"Load a font description from a text file."
-	f = font()
-	f.copyright = f.facename = f.height = f.ascent = None
-	f.italic = f.underline = f.strikeout = 0
-	f.weight = 400
-	f.charset = 0
-	f.inleading = f.exleading = 0
-	f.pointsize = None
-	f.chars = [None] * 256
+def yesno(a):
+	return a == "yes"
 
-	fp = open(file, "r")
-	lineno = 0
-	while 1:
-		s = fp.readline()
-		if s == "":
-			break
-		lineno = lineno + 1
-		while s[-1:] == "\n" or s[-1:] == "\r":
-			s = s[:-1]
-		while s[0:1] == " ":
-			s = s[1:]
-		if s == "" or s[0:1] == "#":
-			continue
-		#space = string.find(s, " ")
-		space = s.find(" ")
-		if space == -1:
-			space = len(s)
-		w = s[:space]
-		a = s[space+1:]
-		if w == "copyright":
-			if len(a) > 59:
-				sys.stderr.write("Copyright too long\n")
-				return None
-			f.copyright = a
-			continue
-		if w == "height":
-			#f.height = string.atoi(a)
-			f.height = int(a)
-			continue
-		if w == "facename":
-			f.facename = a
-			continue
-		if w == "ascent":
-			#f.ascent = string.atoi(a)
-			f.ascent = int(a)
-			continue
-		if w == "inleading":
-			f.inleading = int(a)
-			continue
-		if w == "exleading":
-			f.exleading = int(a)
-			continue
-		if w == "pointsize":
-			#f.pointsize = string.atoi(a)
-			f.pointsize = int(a)
-			continue
-		if w == "weight":
-			#f.weight = string.atoi(a)
-			f.weight = int(a)
-			continue
-		if w == "charset":
-			#f.charset = string.atoi(a)
-			f.charset = int(a)
-			continue
-		if w == "italic":
-			f.italic = a == "yes"
-			continue
-		if w == "underline":
-			f.underline = a == "yes"
-			continue
-		if w == "strikeout":
-			f.strikeout = a == "yes"
-			continue
-		if w == "char":
-			#c = string.atoi(a)
-			c = int(a)
-			y = 0
-			f.chars[c] = char()
-			f.chars[c].width = 0
-			f.chars[c].data = [0] * f.height
-			continue
-		if w == "width":
-			#f.chars[c].width = string.atoi(a)
-			f.chars[c].width = int(a)
-			continue
+def fdcopyright(a):
+	if len(a) > 59:
+		raise ValueError("Copyright too long")
+	return a
+
+# Header keywords: the Font attribute each one sets, and how to convert
+# its argument.
+fdkeywords = {
+	"copyright": ("copyright", fdcopyright),
+	"facename": ("facename", str),
+	"height": ("height", int),
+	"ascent": ("ascent", int),
+	"inleading": ("inleading", int),
+	"exleading": ("exleading", int),
+	"pointsize": ("pointsize", int),
+	"weight": ("weight", int),
+	"charset": ("charset", int),
+	"italic": ("italic", yesno),
+	"underline": ("underline", yesno),
+	"strikeout": ("strikeout", yesno),
+}
+
+# Bitmap rows may be drawn with ".x", "-#" or "01". A line starting
+# with "#" is a comment, so a row must start with one of the others.
+fdpixels = {ord("."):"0", ord("-"):"0", ord("x"):"1", ord("#"):"1"}
+fdrowstart = frozenset(".-x01")
+fdbytes = bytes.maketrans(b".-x#", b"0011")
+
+# A line that can't be a bitmap row: it's a keyword, a comment or an
+# indented line. Matched from the newline before it, and split into
+# indent, first word and the rest.
+fdmark = re.compile(r"\n(?=[^.\-x01\n])( *)([^ \n]*) ?([^\n]*)")
+
+# The usual layout of the chars: char lines for 0 to 255 in order, each
+# followed at once by a width line, with nothing after those but bitmap
+# rows and blank lines. fdnotrow finds the start of every line that
+# isn't one of those.
+fdblock = re.compile(r"\nchar (\d+)\nwidth (\d+)\n")
+fdcharnames = [str(i) for i in range(256)]
+fdnotrow = re.compile(r"\n[^.\-x01\n]")
+
+def fdrows(text, start, end, rows, spans):
+	"""Add the bitmap rows between two positions in the text to the
+	current char's list. Returns end."""
+	region = text[start:end].strip("\n")
+	if region:
+		if rows == None:
+			lineno, col = fdwhere(text, [(start, end)], 0)
+			raise FDError("Unknown keyword " +
+				region.split("\n")[0].lstrip(" ").split(" ")[0], lineno, col)
+		rows.append(region)
+		spans.append((start, end))
+	return end
+
+def fdwhere(text, spans, n):
+	"""Return the line and column of the nth bitmap row found in the
+	given spans of text."""
+	for a, b in spans:
+		p = a
+		for line in text[a:b].split("\n"):
+			t = line.lstrip(" ")
+			if t:
+				if n == 0:
+					p = p + len(line) - len(t)
+					return text.count("\n", 0, p), p - text.rfind("\n", 0, p)
+				n = n - 1
+			p = p + len(line) + 1
+	return None, None
+
+def fdcheck(rows):
+	"Raise IndexError naming the first row that isn't a valid bitmap row."
+	for i in range(len(rows)):
 		try:
-			#w = w.replace(".", "0").replace("x", "1") #mj.J
-			w = w.translate({ord("."):"0", ord("-"):"0", ord("x"):"1", ord("#"):"1"})
-			#value = string.atol(w, 2)
-			value = int(w, 2)
-			bits = len(w)
-			if bits < f.chars[c].width:
-				value = value << (f.chars[c].width - bits)
-			elif bits > f.chars[c].width:
-				value = value >> (bits - f.chars[c].width)
-			f.chars[c].data[y] = value
-			y = y + 1
+			int(rows[i].translate(fdpixels), 2)
 		except ValueError:
-			sys.stderr.write("Unknown keyword "+w+" at line "+"%d"%lineno+"\n")
+			raise IndexError(i)
+
+def fdglyph(regions, width, height, bits):
+	"""Lay out the bitmap rows of one char (given as the regions of text
+	they came in) as height rows of bits pixels, cut or padded on the
+	right, ready for binary decoding. Raises IndexError naming the
+	first bad row."""
+	pad = "." * (bits - width)
+	if len(regions) == 1 and width > 0:
+		# The usual case is exactly height rows of exactly width
+		# pixels, which we can check for without splitting them up.
+		# Bad pixel characters are left for int() to find.
+		r = regions[0]
+		if len(r) == height * (width + 1) - 1 and " " not in r and \
+			r.count("\n") == height - 1 and \
+			r[width::width+1] == "\n" * (height - 1):
+			return r.replace("\n", pad) + pad
+	# Blank lines, missing rows, rows of the wrong length, or rows with
+	# trailing words: fix them up one by one.
+	rows = "\n".join(regions).split("\n")
+	rows = [r.lstrip(" ").split(" ", 1)[0] for r in rows]
+	rows = [r for r in rows if r]
+	fdcheck(rows)
+	if len(rows) > height:
+		raise IndexError(height)
+	return "".join([r[:width].ljust(bits, ".")[:bits] for r in rows]) \
+		+ "." * (bits * (height - len(rows)))
+
+def fdblocks(text, start):
+	"""If the chars, from start on, are laid out in the usual way, find
+	all their widths and bitmap rows in one go. Returns the widths, rows
+	and spans that scanning line by line would have found, or None if
+	they aren't laid out that way."""
+	marks = list(fdblock.finditer(text, start))
+	if len(marks) != 256 or marks[0].start() != start or \
+		len(fdnotrow.findall(text, start)) != 512 or \
+		[m.group(1) for m in marks] != fdcharnames:
+		return None
+	widths = [int(m.group(2)) for m in marks]
+	glyphrows = []
+	glyphspans = []
+	ends = [m.start() for m in marks[1:]] + [len(text)]
+	for i in range(256):
+		a = marks[i].end() - 1
+		region = text[a:ends[i]].strip("\n")
+		glyphrows.append([region] if region else [])
+		glyphspans.append([(a, ends[i])] if region else [])
+	return widths, glyphrows, glyphspans
+
+def fdgrid(glyphrows, widths, height, bits):
+	"""Lay out every char's rows in one go per width, if each char is
+	exactly height rows of exactly its width in pixels. Returns None if
+	not, to fall back to fdglyphs."""
+	groups = {}
+	for i in range(256):
+		width = widths[i]
+		if width == 0 or len(glyphrows[i]) != 1 or \
+			len(glyphrows[i][0]) != height * (width + 1) - 1:
+			return None
+		groups.setdefault(width, []).append(i)
+	chunks = [None] * 256
+	size = height * bits
+	for width, chars in groups.items():
+		# Each char is the right length, so if the rows joined with
+		# newlines are a perfect grid, each char has height rows.
+		r = "\n".join([glyphrows[i][0] for i in chars])
+		n = len(chars) * height
+		if len(r) != n * (width + 1) - 1 or " " in r or \
+			r.count("\n") != n - 1 or r[width::width+1] != "\n" * (n - 1):
 			return None
+		pad = "." * (bits - width)
+		r = r.replace("\n", pad) + pad
+		for k in range(len(chars)):
+			chunks[chars[k]] = r[k*size:(k+1)*size]
+	return chunks
+
+def fdglyphs(text, glyphrows, glyphspans, widths, height, bits):
+	"""Lay out every char's rows with fdglyph, turning any IndexError
+	into an FDError at the offending line of text."""
+	chunks = []
+	for i in range(256):
+		try:
+			chunk = fdglyph(glyphrows[i], widths[i], height, bits)
+		except IndexError as e:
+			n = e.args[0]
+			lineno, col = fdwhere(text, glyphspans[i], n)
+			if n == height:
+				raise FDError("Too many bitmap rows for char %d" % i,
+					lineno, col)
+			raise FDError("Unknown keyword " + text.split("\n")[lineno]
+				.lstrip(" ").split(" ")[0], lineno, col)
+		if widths[i] == 0:
+			chunk = "." * (bits * height)
+		chunks.append(chunk)
+	return chunks
+
+def parsefont(source):
+	"""Load a font description from a string, a file object or any
+	iterable of lines. Raises FDError on any error."""
+	if isinstance(source, str):
+		text = source
+	elif hasattr(source, "read"):
+		text = source.read()
+	else:
+		text = "\n".join([line.rstrip("\r\n") for line in source])
+	if "\r" in text:
+		text = text.replace("\r\n", "\n").replace("\r", "\n")
+	# Work on positions in the text rather than on lines: with a newline
+	# in front, every line starts just after a newline, and line numbers
+	# are just counts of newlines.
+	text = "\n" + text + "\n"
+
+	# First pass: header keywords, char and width lines, and the text
+	# of each char's bitmap rows.
+	f = Font()
+	widths = [0] * 256
+	glyphrows = [None] * 256
+	glyphspans = [None] * 256
+	c = None
+	rows = spans = None
+	prev = 0
+	for m in fdmark.finditer(text):
+		indent, w, a = m.groups()
+		if indent and w[:1] in fdrowstart:
+			# An indented row: leave it in with the rows around it.
+			continue
+		if m.start() > prev + 1:
+			# Bitmap rows (and perhaps blank lines) since the last mark.
+			prev = fdrows(text, prev, m.start(), rows, spans)
+		prev = m.end()
+		if w == "" or w[0] == "#":
+			continue
+		col = len(indent) + 1
+		kw = fdkeywords.get(w)
+		if kw != None:
+			try:
+				setattr(f, kw[0], kw[1](a))
+			except ValueError as e:
+				raise FDError(str(e) if kw[0] == "copyright" else \
+					"Bad value for " + w, text.count("\n", 0, prev),
+					col + len(w) + 1)
+		elif w == "char" or w == "width":
+			try:
+				n = int(a)
+			except ValueError:
+				raise FDError("Bad value for " + w, text.count("\n", 0, prev),
+					col + len(w) + 1)
+			if w == "char":
+				if n < 0 or n > 255:
+					raise FDError("Char %d out of range" % n,
+						text.count("\n", 0, prev), col + len(w) + 1)
+				if c == None:
+					# The first char: try the rest in one go.
+					blocks = fdblocks(text, m.start())
+					if blocks != None:
+						widths, glyphrows, glyphspans = blocks
+						break
+				c = n
+				widths[c] = 0
+				glyphrows[c] = rows = []
+				glyphspans[c] = spans = []
+			else:
+				if c == None:
+					raise FDError("width before any char",
+						text.count("\n", 0, prev), col)
+				widths[c] = n
+		else:
+			raise FDError("Unknown keyword " + w, text.count("\n", 0, prev),
+				col)
+	else:
+		fdrows(text, prev, len(text), rows, spans)
 
 	if f.copyright == None:
-		sys.stderr.write("No font copyright specified\n")
-		return None
+		raise FDError("No font copyright specified")
 	if f.height == None:
-		sys.stderr.write("No font height specified\n")
-		return None
+		raise FDError("No font height specified")
 	if f.ascent == None:
-		sys.stderr.write("No font ascent specified\n")
-		return None
+		raise FDError("No font ascent specified")
 	if f.facename == None:
-		sys.stderr.write("No font face name specified\n")
-		return None
+		raise FDError("No font face name specified")
 	for i in range(256):
-		if f.chars[i] == None:
-			sys.stderr.write("No character at position " + "%d"%i + "\n")
-			return None
+		if glyphrows[i] == None:
+			raise FDError("No character at position " + "%d"%i)
 	if f.pointsize == None:
 		#f.pointsize = f.height
 		# hightish * 72 ppi / nominal vertical resolution dpi
 		f.pointsize = round((f.height - f.inleading) * 72 / 96)
+
+	# Second pass: now the stride is known, lay out every char's rows
+	# and decode the whole font as one binary number in store layout.
+	height = f.height
+	f.reset(height, rowbytes(max(widths)))
+	f.widths[:] = array.array("H", widths)
+	bits = 8 * f.stride
+	chunks = fdgrid(glyphrows, widths, height, bits)
+	if chunks == None:
+		chunks = fdglyphs(text, glyphrows, glyphspans, widths, height, bits)
+	try:
+		value = int("".join(chunks).encode("ascii", "replace")
+			.translate(fdbytes) or b"0", 2)
+	except ValueError:
+		# Some char has a bad row: find it and report it.
+		for i in range(256):
+			rows = "\n".join(glyphrows[i]).split("\n")
+			rows = [r.lstrip(" ").split(" ", 1)[0] for r in rows]
+			rows = [r for r in rows if r]
+			try:
+				fdcheck(rows)
+			except IndexError as e:
+				n = e.args[0]
+				lineno, col = fdwhere(text, glyphspans[i], n)
+				raise FDError("Unknown keyword " + rows[n], lineno, col)
+		raise
+	f.bits[:] = value.to_bytes(len(f.bits), "big")
 	return f
 
-def fnt(font):
-	"Generate the contents of a .FNT file, given a font description."
+def loadfont(file):
+	"""Load a font description from a text file, or from a packed font
+	(see winfontpack). Raises FDError on errors in a text file, or
+	FontError if a packed one can't be read."""
+	fp = open(file, "rb")
+	packed = winfontpack.ispacked(fp.read(len(winfontpack.magic)))
+	fp.close()
+	if packed:
+		return winfontpack.loadfile(file)
+	fp = open(file, "r")
+	try:
+		return parsefont(fp)
+	except FDError as e:
+		e.filename = file
+		raise
+	finally:
+		fp.close()
 
+# Bump this whenever fnt() would produce different bytes for the same
+# font, so that cached .FNT data (see winfontcache) is not reused.
+fntversion = 1
+
+# Fixed part of a version 3.00 FNT header, up to the start of the char
+# table. The fields are, in order: version, file size, copyright, type,
+# point size, vertical and horizontal resolution, ascent, internal and
+# external leading, italic, underline, strikeout, weight, charset, pixel
+# width, pixel height, pitch and family, average width, maximum width,
+# first char, last char, default char, break char, width bytes, device
+# name offset, face name offset, bits pointer, bits offset, reserved,
+# flags, A/B/C spaces, colour pointer and 16 reserved bytes.
+fnthdr = struct.Struct("<HL60sHHHHHHHBBBHBHHBHHBBBBHLLLLBLHHHL16s")
+assert fnthdr.size == 0x94
+chtentry = struct.Struct("<HL")
+# The whole char table: 256 chars plus the sentinel.
+chartable = struct.Struct("<" + "HL" * 257)
+
+def fnt(font, dedup=0):
+	"""Generate the contents of a .FNT file, given a font description.
+	If dedup is set, identical glyph bitmaps are stored only once."""
+
+	widths = font.widths
 	# Average width is defined by Windows to be the width of 'X'.
-	avgwidth = font.chars[ord('X')].width
-	# Max width we calculate from the font. During this loop we also
-	# check if the font is fixed-pitch.
-	maxwidth = 0
-	fixed = 1
-	for i in range(0,256):
-		if avgwidth != font.chars[i].width:
-			fixed = 0
-		if maxwidth < font.chars[i].width:
-			maxwidth = font.chars[i].width
+	avgwidth = widths[ord('X')]
+	# Max width we calculate from the font. The font is fixed-pitch if
+	# every char has the average width.
+	maxwidth = max(widths)
+	fixed = widths.count(avgwidth) == 256
 	# Work out how many 8-pixel wide columns we need to represent a char.
 	# widthbytes = 3 # FIXME!
 	#widthbytes = (maxwidth+7)/8
 	#widthbytes = (widthbytes+1) &~ 1  # round up to multiple of 2
-	widthbytes = ((maxwidth - 1) // 16 + 1) * 2
+	widthbytes = rowbytes(maxwidth)
 
-	file = b""
-	file = file + word(0x0300) # file version
-	file = file + dword(0)     # file size (come back and fix later)
-	copyright = font.copyright + ("\0" * 60)
-	copyright = copyright[0:60]
-	file = file + bytes(copyright, encoding="windows-1252")
-	file = file + word(0)      # font type (raster, bits in file)
-	file = file + word(font.pointsize) # nominal point size
-	file = file + word(96)     # nominal vertical resolution (dpi)
-	file = file + word(96)     # nominal horizontal resolution (dpi)
-	file = file + word(font.ascent)   # top of font <--> baseline
-	file = file + word(f.inleading)   # internal leading
-	file = file + word(f.exleading)   # external leading
-	file = file + byte(font.italic)
-	file = file + byte(font.underline)
-	file = file + byte(font.strikeout)
-	file = file + word(font.weight) # 1 to 1000 (100-900); 400 is normal.
-	file = file + byte(font.charset)
+	# Lay the whole file out before writing anything: the header, then
+	# 257 char table entries (the last one a blank sentinel), then one
+	# fixed-size bitmap per entry, then the face name.
+	charsize = widthbytes * font.height
+	offset_chartbl = fnthdr.size
+	offset_bitmaps = offset_chartbl + 257 * chtentry.size
+
+	# Each char is stored as widthbytes columns of font.height bytes,
+	# so the bitmaps are evenly spaced and the table is packed in one
+	# go. The font's row-major store, plus a blank sentinel char of the
+	# average width, is transposed in one go too.
+	entries = [0] * 514
 	if fixed:
-		pixwidth = avgwidth
+		entries[0::2] = [avgwidth] * 257
 	else:
-		pixwidth = 0
-	file = file + word(pixwidth) # width, or 0 if var-width
-	file = file + word(font.height) # height
+		entries[0:512:2] = widths
+		entries[512] = avgwidth
+	entries[1::2] = range(offset_bitmaps, offset_bitmaps + 257 * charsize,
+		charsize)
+	rows = font.bitmap(widthbytes) + bytes(charsize)
+	bitmaps = winbitmap.rowstocols(rows, 257, font.height, widthbytes)
+	if dedup and charsize:
+		bitmaps = sharebitmaps(bitmaps, charsize, entries, offset_bitmaps)
+
+	offset_facename = offset_bitmaps + len(bitmaps)
+	facename = bytes(font.facename, encoding="windows-1252") + b"\0"
+	filesize = offset_facename + len(facename)
+	file = bytearray(filesize)
+
 	if fixed:
+		pixwidth = avgwidth
 		pitchfamily = 0
-	else:
-		pitchfamily = 1
-	file = file + byte(pitchfamily) # pitch and family
-	file = file + word(avgwidth)
-	file = file + word(maxwidth)
-	file = file + byte(0)          # first char
-	file = file + byte(255)        # last char
-	file = file + byte(63)         # default char "?" (relative to first char)
-	file = file + byte(32)         # break char (relative to first char)
-	file = file + word(widthbytes) # dfWidthBytes
-	file = file + dword(0)         # device
-	file = file + dword(0)         # face name
-	file = file + dword(0)         # BitsPointer (used at load time)
-	file = file + dword(0)         # pointer to bitmap data
-	file = file + byte(0)          # reserved
-	if fixed:
 		dfFlags = 1
 	else:
+		pixwidth = 0       # width, or 0 if var-width
+		pitchfamily = 1
 		dfFlags = 2
-	file = file + dword(dfFlags)   # dfFlags
-	file = file + word(0) + word(0) + word(0) # Aspace, Bspace, Cspace
-	file = file + dword(0)         # colour pointer
-	file = file + (b"\0" * 16)      # dfReserved1
-
-	# Now the char table.
-	offset_chartbl = len(file)
-	offset_bitmaps = offset_chartbl + 257 * 6
-	# Fix up the offset-to-bitmaps at 0x71.
-	file = file[:0x71] + dword(offset_bitmaps) + file[0x71+4:]
-	bitmaps = b""
-	for i in range(0,257):
-		if i < 256:
-			width = font.chars[i].width
-		else:
-			width = avgwidth
-		file = file + word(width)
-		file = file + dword(offset_bitmaps + len(bitmaps))
-		for j in range(widthbytes):
-			for k in range(font.height):
-				if i < 256:
-					chardata = font.chars[i].data[k]
-				else:
-					chardata = 0
-				chardata = chardata << (8*widthbytes - width)
-				bitmaps = bitmaps + byte(chardata >> (8*(widthbytes-j-1)))
-
-	file = file + bitmaps
-	# Now the face name. Fix up the face name offset at 0x69.
-	file = file[:0x69] + dword(len(file)) + file[0x69+4:]
-	file = file + bytes(font.facename, encoding="windows-1252") + b"\0"
-	# And finally fix up the file size at 0x2.
-	file = file[:0x2] + dword(len(file)) + file[0x2+4:]
+	copyright = font.copyright + ("\0" * 60)
+	copyright = copyright[0:60]
+	fnthdr.pack_into(file, 0,
+		0x0300,            # file version
+		filesize,
+		bytes(copyright, encoding="windows-1252"),
+		0,                 # font type (raster, bits in file)
+		font.pointsize & 0xFFFF, # nominal point size
+		96,                # nominal vertical resolution (dpi)
+		96,                # nominal horizontal resolution (dpi)
+		font.ascent & 0xFFFF, # top of font <--> baseline
+		font.inleading & 0xFFFF, # internal leading
+		font.exleading & 0xFFFF, # external leading
+		font.italic & 0xFF,
+		font.underline & 0xFF,
+		font.strikeout & 0xFF,
+		font.weight & 0xFFFF, # 1 to 1000 (100-900); 400 is normal.
+		font.charset & 0xFF,
+		pixwidth & 0xFFFF,
+		font.height & 0xFFFF,
+		pitchfamily,
+		avgwidth & 0xFFFF,
+		maxwidth & 0xFFFF,
+		0,                 # first char
+		255,               # last char
+		63,                # default char "?" (relative to first char)
+		32,                # break char (relative to first char)
+		widthbytes & 0xFFFF, # dfWidthBytes
+		0,                 # device
+		offset_facename,   # face name
+		0,                 # BitsPointer (used at load time)
+		offset_bitmaps,    # pointer to bitmap data
+		0,                 # reserved
+		dfFlags,
+		0, 0, 0,           # Aspace, Bspace, Cspace
+		0,                 # colour pointer
+		b"")               # dfReserved1
+
+	# Now the char table and the bitmaps.
+	chartable.pack_into(file, offset_chartbl, *entries)
+	file[offset_bitmaps:offset_facename] = bitmaps
+
+	file[offset_facename:] = facename
 
 	# Done.
-	return file
+	return bytes(file)
+
+def sharebitmaps(bitmaps, charsize, entries, offset_bitmaps):
+	"""Store each distinct charsize-byte bitmap in bitmaps once, pointing
+	the offsets in the char table entries (every other item, from the
+	second) at the copy kept. Returns the bitmaps that are left."""
+	seen = {}
+	out = []
+	for i in range(len(bitmaps) // charsize):
+		glyph = bitmaps[i*charsize:(i+1)*charsize]
+		off = seen.get(glyph)
+		if off == None:
+			off = offset_bitmaps + len(out) * charsize
+			seen[glyph] = off
+			out.append(glyph)
+		entries[2*i+1] = off
+	return b"".join(out)
+
+def fntshared(f):
+	"""Return how many of the char table entries in the .FNT data f
+	point at a bitmap an earlier entry already uses, and how many bytes
+	that saves over storing every bitmap separately."""
+	height = fromword(f[0x58:0x5A])
+	widthbytes = fromword(f[0x63:0x65])
+	offsets = set(struct.unpack_from("<" + "2xL" * 257, f, fnthdr.size))
+	shared = 257 - len(offsets)
+	return shared, shared * height * widthbytes
+
+def fntfacename(f):
+	"Return the face name stored in the data of a .FNT file."
+	return str(asciz(f[fromdword(f[0x69:]):]), encoding="windows-1252")
 
 def direntry(f):
 	"Return the FONTDIRENTRY, given the data in a .FNT file."
@@ -311,47 +568,52 @@ stubcode = [
 ]
 stubmsg = b"This is not a program!\r\nFont library created by mkwinfont.\r\n"
 
+mzheader = struct.Struct("<2s13H8xHH20xL")
+
 def stub():
 	"Create a small MZ executable."
-	file = b""
-	file = file + b"MZ" + word(0) + word(0)
-	file = file + word(0) # no relocations
-	file = file + word(4) # 4-para header
-	file = file + word(0x10) # 16 extra para for stack
-	file = file + word(0xFFFF) # maximum extra paras: LOTS
-	file = file + word(0) + word(0x100) # SS:SP = 0000:0100
-	file = file + word(0) # no checksum
-	file = file + word(0) + word(0) # CS:IP = 0:0, start at beginning
-	file = file + word(0x40) # reloc table beyond hdr
-	file = file + word(0) # overlay number
-	file = file + 4 * word(0) # reserved
-	file = file + word(0) + word(0) # OEM id and OEM info
-	file = file + 10 * word(0) # reserved
-	file = file + dword(0) # offset to NE header
-	assert len(file) == 0x40
-	for i in stubcode: file = file + byte(i)
-	file = file + stubmsg + b"$"
-	n = len(file)
-	#pages = (n+511) / 512
+	code = bytes(stubcode) + stubmsg + b"$"
+	n = mzheader.size + len(code)
 	pages = (n+511) // 512
 	lastpage = n - (pages-1) * 512
-	file = file[:2] + word(lastpage) + word(pages) + file[6:]
-	# Now assume there will be a NE header. Create it and fix up the
-	# offset to it.
-	while len(file) % 16: file = file + b"\0"
-	file = file[:0x3C] + dword(len(file)) + file[0x40:]
-	return file
+	# Pad to a paragraph, assuming a NE header will follow, and point
+	# the header's e_lfanew at it.
+	file = bytearray((n+15) &~ 15)
+	mzheader.pack_into(file, 0, b"MZ", lastpage, pages,
+		0,          # no relocations
+		4,          # 4-para header
+		0x10,       # 16 extra para for stack
+		0xFFFF,     # maximum extra paras: LOTS
+		0, 0x100,   # SS:SP = 0000:0100
+		0,          # no checksum
+		0, 0,       # CS:IP = 0:0, start at beginning
+		0x40,       # reloc table beyond hdr
+		0,          # overlay number
+		0, 0,       # OEM id and OEM info
+		len(file))  # offset to NE header
+	file[mzheader.size:n] = code
+	return bytes(file)
 
-def fon(name, fonts):
-	"Create a .FON font library, given a bunch of .FNT file contents."
+neheader = struct.Struct("<2sBBHHLHHHHLLHHHHHHHHLHHHBBHHHH")
+typeinfo = struct.Struct("<HHL")
+nameinfo = struct.Struct("<HHHHL")
 
-	name = bytes(name, encoding="windows-1252")
+def fontdir(fonts):
+	"Construct the FONTDIR resource, given the data of each .FNT."
+	return fontdirof([direntry(f) for f in fonts])
 
-	# Construct the FONTDIR.
-	fontdir = word(len(fonts))
-	for i in range(len(fonts)):
-		fontdir = fontdir + word(i+1)
-		fontdir = fontdir + direntry(fonts[i])
+def fontdirof(entries):
+	"Construct the FONTDIR resource from each font's FONTDIRENTRY."
+	return word(len(entries)) + b"".join([word(i+1) + entries[i]
+		for i in range(len(entries))])
+
+def fonlayout(name, nfonts):
+	"""Lay out the headers of a .FON holding nfonts fonts. Returns (head,
+	tablepos, datapos): the MZ stub, NE header and name tables, with a
+	gap at file offset tablepos for restable() to fill in; and the file
+	offset, on a 16-byte boundary, where the resource data may start."""
+
+	name = bytes(name, encoding="windows-1252")
 
 	# The MZ stub.
 	stubdata = stub()
@@ -359,100 +621,204 @@ def fon(name, fonts):
 	nonres = b"FONTRES 100,96,96 : " + name
 	nonres = byte(len(nonres)) + nonres + b"\0\0\0"
 	# Resident name table should just contain a module name.
-	mname = b""
-	for c in name:
-		if c in b"0123546789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz":
-			mname = mname + bytes([c])
+	mname = bytes([c for c in name if c in
+		b"0123546789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"])
 	res = byte(len(mname)) + mname + b"\0\0\0"
 	# Entry table / imported names table should contain a zero word.
 	entry = word(0)
 
-	# Compute length of resource table.
-	# 12 (2 for the shift count, plus 2 for end-of-table, plus 8 for the
-	#    "FONTDIR" resource name), plus
-	# 20 for FONTDIR (TYPEINFO and NAMEINFO), plus
-	# 8 for font entry TYPEINFO, plus
-	# 12 for each font's NAMEINFO 
-
-	# Resources are currently one FONTDIR plus n fonts.
-	# TODO: a VERSIONINFO resource would be nice too.
-	resrcsize = 12 + 20 + 8 + 12 * len(fonts)
-	resrcpad = ((resrcsize + 15) &~ 15) - resrcsize
-
 	# Now position all of this after the NE header.
-	p = 0x40        # NE header size
+	p = neheader.size
 	off_segtable = off_restable = p
-	p = p + resrcsize + resrcpad
+	p = p + restablesize(nfonts)
 	off_res = p
 	p = p + len(res)
 	off_modref = off_import = off_entry = p
 	p = p + len(entry)
 	off_nonres = p
 	p = p + len(nonres)
+	p = (p+15) &~ 15
+
+	head = bytearray(len(stubdata) + p)
+	head[:len(stubdata)] = stubdata
+	neheader.pack_into(head, len(stubdata), b"NE", 5, 10,
+		off_entry, len(entry),
+		0,                 # no CRC
+		0x8308,            # the Mysterious Flags
+		0, 0, 0,           # no autodata, no heap, no stk
+		0, 0,              # CS:IP == SS:SP == 0
+		0, 0,              # segment table len, modreftable len
+		len(nonres),
+		off_segtable, off_restable,
+		off_res, off_modref, off_import,
+		len(stubdata) + off_nonres,
+		0,                 # no movable entries
+		4,                 # seg align shift count
+		0,                 # no resource segments
+		2, 8,              # target OS and more Mysterious Flags
+		0, 0, 0, 0x300)
+	base = len(stubdata)
+	head[base+off_res:base+off_res+len(res)] = res
+	head[base+off_entry:base+off_entry+len(entry)] = entry
+	head[base+off_nonres:base+off_nonres+len(nonres)] = nonres
+	return bytes(head), base + off_restable, len(head)
 
-	pad = ((p+15) &~ 15) - p
-	p = p + pad
-	q = p + len(stubdata)
+def restablesize(nfonts):
+	"""Return the padded size of the resource table for nfonts fonts.
 
-	# Now q is file offset where the real resources begin. So we can
-	# construct the actual resource table, and the resource data too.
-	restable = word(4) # shift count
-	resdata = b""
+	That's 12 (2 for the shift count, plus 2 for end-of-table, plus 8
+	for the "FONTDIR" resource name), plus 20 for FONTDIR (TYPEINFO and
+	NAMEINFO), plus 8 for font entry TYPEINFO, plus 12 for each font's
+	NAMEINFO, rounded up to 16 bytes."""
+	# Resources are currently one FONTDIR plus n fonts.
+	# TODO: a VERSIONINFO resource would be nice too.
+	return (12 + 20 + 8 + 12 * nfonts + 15) &~ 15
+
+def ressegment(place):
+	"""Convert a resource's (file offset, size) to the 16-byte units of
+	the resource table, or raise FontError if they don't fit."""
+	offset, length = place
+	length = (length+15) >> 4
+	if offset >> 4 > 0xFFFF or length > 0xFFFF:
+		raise FontError("font library too large for a .FON file")
+	return offset >> 4, length
+
+def restable(places):
+	"""Construct the resource table, given the (file offset, size) of
+	the FONTDIR and then of each font resource."""
+	nfonts = len(places) - 1
+	size = 12 + 20 + 8 + 12 * nfonts
+	table = bytearray(restablesize(nfonts))
+	p = 0
+	struct.pack_into("<H", table, p, 4) # shift count
+	p = p + 2
 	# The FONTDIR resource.
-	restable = restable + word(0x8007) + word(1) + dword(0)
-	restable = restable + word((q+len(resdata)) >> 4)
-	start = len(resdata)
-	resdata = resdata + fontdir
-	while len(resdata) % 16: resdata = resdata + b"\0"    
-	restable = restable + word((len(resdata)-start) >> 4)
-	restable = restable + word(0x0C50) + word(resrcsize-8) + dword(0)
+	typeinfo.pack_into(table, p, 0x8007, 1, 0)
+	p = p + typeinfo.size
+	nameinfo.pack_into(table, p, *ressegment(places[0]), 0x0C50, size-8, 0)
+	p = p + nameinfo.size
 	# The font resources.
-	restable = restable + word(0x8008) + word(len(fonts)) + dword(0)
-	for i in range(len(fonts)):
-		restable = restable + word((q+len(resdata)) >> 4)
-		start = len(resdata)
-		resdata = resdata + fonts[i]
-		while len(resdata) % 16: resdata = resdata + b"\0"    
-		restable = restable + word((len(resdata)-start) >> 4)
-		restable = restable + word(0x1C30) + word(0x8001 + i) + dword(0)
-	# The zero word.
-	restable = restable + word(0)
-	assert len(restable) == resrcsize - 8
-	restable = restable + b"\007FONTDIR"
-	restable = restable + b"\0" * resrcpad
-
-	file = stubdata + b"NE" + byte(5) + byte(10)
-	file = file + word(off_entry) + word(len(entry))
-	file = file + dword(0) # no CRC
-	file = file + word(0x8308) # the Mysterious Flags
-	file = file + word(0) + word(0) + word(0) # no autodata, no heap, no stk
-	file = file + dword(0) + dword(0) # CS:IP == SS:SP == 0
-	file = file + word(0) + word(0) # segment table len, modreftable len
-	file = file + word(len(nonres))
-	file = file + word(off_segtable) + word(off_restable)
-	file = file + word(off_res) + word(off_modref) + word(off_import)
-	file = file + dword(len(stubdata) + off_nonres)
-	file = file + word(0) # no movable entries
-	file = file + word(4) # seg align shift count
-	file = file + word(0) # no resource segments
-	file = file + byte(2) + byte(8) # target OS and more Mysterious Flags
-	file = file + word(0) + word(0) + word(0) + word(0x300)
-
-	# Now add in all the other stuff.
-	file = file + restable + res + entry + nonres + b"\0" * pad + resdata
-
-	return file
+	typeinfo.pack_into(table, p, 0x8008, nfonts, 0)
+	p = p + typeinfo.size
+	for i in range(nfonts):
+		nameinfo.pack_into(table, p, *ressegment(places[i+1]), 0x1C30,
+			0x8001 + i, 0)
+		p = p + nameinfo.size
+	# The zero word, then the name.
+	p = p + 2
+	assert p == size - 8
+	table[p:p+8] = b"\007FONTDIR"
+	return bytes(table)
 
-if __name__ == "__main__":
+def fon(name, fonts):
+	"""Create a .FON font library, given a bunch of .FNT file contents.
+	Fonts whose data is identical share one copy in the file."""
+
+	fonts = [bytes(f) for f in fonts]
+	head, tablepos, p = fonlayout(name, len(fonts))
+
+	# First pass: give each distinct resource a place in the file,
+	# 16-byte aligned.
+	places = []
+	data = []
+	seen = {}
+	for r in [fontdir(fonts)] + fonts:
+		place = seen.get(r)
+		if place == None:
+			place = seen[r] = (p, len(r))
+			data.append((p, r))
+			p = (p + len(r) + 15) &~ 15
+		places.append(place)
+
+	# Second pass: copy everything into place in one buffer.
+	file = bytearray(p)
+	file[:len(head)] = head
+	table = restable(places)
+	file[tablepos:tablepos+len(table)] = table
+	for offset, r in data:
+		file[offset:offset+len(r)] = r
+	return bytes(file)
+
+class FonWriter:
+	"""Write a .FON font library to a seekable binary file one .FNT at a
+	time, keeping only each font's FONTDIRENTRY and a hash of its data.
+
+	The headers are laid out as soon as the first font arrives (which
+	names the library, if no name was given) and written with the
+	resource table left blank; room for the FONTDIR is reserved after
+	them, assuming every font's FONTDIRENTRY is the length of the
+	first's. Each font is then written as it is added, or pointed at an
+	identical earlier one, and close() seeks back to fill in the FONTDIR
+	and resource table. The output is the same as fon() produces."""
+
+	def __init__(self, fp, nfonts, name=None):
+		self.fp = fp
+		self.nfonts = nfonts
+		self.name = name
+		self.base = fp.tell()
+		self.places = []
+		self.seen = {}
+		self.entries = []
+
+	def add(self, data):
+		"Append the data of one .FNT file."
+		entry = direntry(data)
+		if len(self.entries) == 0:
+			if self.name == None:
+				self.name = fntfacename(data)
+			head, self.tablepos, p = fonlayout(self.name, self.nfonts)
+			self.dirsize = 2 + self.nfonts * (2 + len(entry))
+			self.fp.write(head)
+			self.fp.write(bytes(((p + self.dirsize + 15) &~ 15) - p))
+			self.places.append((p, self.dirsize))
+			self.end = self.base + p + ((self.dirsize + 15) &~ 15)
+		if len(self.entries) == self.nfonts:
+			raise ValueError("more fonts than the library was laid out for")
+		self.entries.append(entry)
+		key = hashlib.sha256(data).digest()
+		place = self.seen.get(key)
+		if place == None:
+			place = self.seen[key] = (self.end - self.base, len(data))
+			ressegment(place)
+			self.fp.write(data)
+			self.fp.write(bytes(-len(data) & 15))
+			self.end = self.end + ((len(data) + 15) &~ 15)
+		self.places.append(place)
+
+	def close(self):
+		"""Fill in the FONTDIR and resource table. Returns the size of the
+		library; the file is left positioned at its end."""
+		if len(self.entries) != self.nfonts or self.nfonts == 0:
+			raise ValueError("library laid out for %d fonts, given %d" %
+				(self.nfonts, len(self.entries)))
+		d = fontdirof(self.entries)
+		if len(d) != self.dirsize:
+			# Some face names differ in length, so the FONTDIR doesn't
+			# fit its slot; put it at the end instead.
+			self.places[0] = (self.end - self.base, len(d))
+			ressegment(self.places[0])
+			self.fp.write(d + bytes(-len(d) & 15))
+			self.end = self.end + ((len(d) + 15) &~ 15)
+		else:
+			self.fp.seek(self.base + self.places[0][0])
+			self.fp.write(d)
+		self.fp.seek(self.base + self.tablepos)
+		self.fp.write(restable(self.places))
+		self.fp.seek(self.end)
+		return self.end - self.base
+
+def parseargs(a):
+	"""Parse a mkwinfont command line. Returns (outfile, facename,
+	fonmode, infiles, cachedir, dedup, incremental); raises ValueError
+	if it makes no sense."""
 	outfile = None
 	facename = None
+	cachedir = None
 	fonmode = 1
+	dedup = 0
+	incremental = 0
 	infiles = []
-	a = sys.argv[1:]
 	options = 1
-	if len(a) == 0:
-		print("usage: mkwinfont [-fnt | -fon] [-o outfile] [-facename name] files")
-		sys.exit(0)
 	while len(a) > 0:
 		if a[0] == "--":
 			options = 0
@@ -463,21 +829,31 @@ if __name__ == "__main__":
 					outfile = a[1]
 					a = a[2:]
 				except IndexError:
-					sys.stderr.write("option -o requires an argument\n")
-					sys.exit(1)
+					raise ValueError("option -o requires an argument")
 			elif a[0] == "-facename":
 				try:
 					facename = a[1]
 					a = a[2:]
 				except IndexError:
-					sys.stderr.write("option -facename requires an argument\n")
-					sys.exit(1)
+					raise ValueError("option -facename requires an argument")
+			elif a[0] == "-cache":
+				try:
+					cachedir = a[1]
+					a = a[2:]
+				except IndexError:
+					raise ValueError("option -cache requires an argument")
 			elif a[0] == "-fnt":
 				fonmode = 0
 				a = a[1:]
 			elif a[0] == "-fon":
 				fonmode = 1
 				a = a[1:]
+			elif a[0] == "-dedup":
+				dedup = 1
+				a = a[1:]
+			elif a[0] == "-incremental":
+				incremental = 1
+				a = a[1:]
 			else:
 				sys.stderr.write("ignoring unrecognised option "+a[0]+"\n")
 				a = a[1:]
@@ -485,47 +861,207 @@ if __name__ == "__main__":
 			infiles = infiles + [a[0]]
 			a = a[1:]
 
-	if len(infiles) < 0:
-		sys.stderr.write("no input files specified\n")
-		sys.exit(1)
+	if len(infiles) == 0:
+		raise ValueError("no input files specified")
 
 	if outfile == None:
-		sys.stderr.write("no output file specified\n")
-		sys.exit(1)
+		raise ValueError("no output file specified")
 
 	if fonmode == 0 and len(infiles) > 1:
-		sys.stderr.write("FNT mode can only process one font\n")
-		sys.exit(1)
+		raise ValueError("FNT mode can only process one font")
+
+	if incremental and dedup:
+		raise ValueError("-incremental and -dedup can't be used together")
+
+	return outfile, facename, fonmode, infiles, cachedir, dedup, incremental
+
+class Dedup:
+	"""Asks for identical glyph bitmaps to be stored once, and tallies
+	what that saves in the fonts compiled."""
 
-	fnts = []
-	fds = []
+	def __init__(self):
+		self.fonts = self.shared = self.saved = 0
+
+	def add(self, data):
+		"Count the sharing in one font's .FNT data."
+		shared, saved = fntshared(data)
+		self.fonts = self.fonts + 1
+		self.shared = self.shared + shared
+		self.saved = self.saved + saved
+
+	def stats(self):
+		"Summarise the savings in one line."
+		return "dedup: %d glyph bitmaps shared in %d fonts, %d bytes saved" % \
+			(self.shared, self.fonts, self.saved)
+
+def compile(infiles, facename=None, cache=None, dedup=None):
+	"""Generate the .FNT data for each of some .fd files in turn, using
+	a winfontcache.FntCache if one is given, and sharing identical
+	glyph bitmaps if given a Dedup."""
 	for fname in infiles:
+		if cache != None:
+			fp = open(fname, "rb")
+			key = cache.key(fp.read(), fntversion, facename, dedup != None)
+			fp.close()
+			data = cache.get(key)
+			if data != None:
+				if dedup != None:
+					dedup.add(data)
+				yield data
+				continue
 		f = loadfont(fname)
-		if f == None:
-			sys.stderr.write("unable to load font description "+fname+"\n")
-			sys.exit(1)
 		if facename != None:
 			f.facename = facename
-		fds = fds + [f]
-		fnts = fnts + [fnt(f)]
+		data = fnt(f, dedup != None)
+		if cache != None:
+			cache.put(key, data)
+		if dedup != None:
+			dedup.add(data)
+		yield data
 
+def build(infiles, fonmode=1, facename=None, cache=None, dedup=None):
+	"""Compile .fd files into the contents of a .FNT file (fonmode 0,
+	one input only) or a .FON file. If a winfontcache.FntCache is
+	given, unchanged inputs are not recompiled, and with a Dedup,
+	identical glyph bitmaps are stored once. Raises FDError if an
+	input can't be loaded, or FontError if the fonts need a
+	-facename."""
+	fnts = list(compile(infiles, facename, cache, dedup))
 	if fonmode == 0:
-		outfp = open(outfile, "wb")
-		outfp.write(fnts[0])
-		outfp.close()
-	else:
-		# If all supplied fonts have the same face name, use that.
-		# Otherwise, require that one be input.
-		autoname = fds[0].facename
-		for f in fds[1:]:
-			if autoname != f.facename:
-				autoname = None
-		if facename == None:
-			facename = autoname
-		if facename == None:
-			sys.stderr.write("fonts disagree on face name; "+\
-			"specify one with -facename\n")
+		return fnts[0]
+	return library(fnts, facename)
+
+def compiletext(text, facename=None, cache=None, dedup=None):
+	"""Compile .fd text into .FNT data, giving it another face name if
+	one is given, using a winfontcache cache if there is one, and
+	sharing identical glyph bitmaps if given a Dedup."""
+	if cache != None:
+		key = cache.key(text.encode("utf-8"), fntversion, facename,
+			dedup != None)
+		data = cache.get(key)
+		if data != None:
+			if dedup != None:
+				dedup.add(data)
+			return data
+	f = parsefont(text)
+	if facename != None:
+		f.facename = facename
+	data = fnt(f, dedup != None)
+	if cache != None:
+		cache.put(key, data)
+	if dedup != None:
+		dedup.add(data)
+	return data
+
+def library(fnts, facename=None):
+	"""Link .FNT data into a .FON file named facename, or if that is None
+	the face name all the fonts share. Raises FontError if they don't."""
+	# If all supplied fonts have the same face name, use that.
+	# Otherwise, require that one be input.
+	names = [fntfacename(data) for data in fnts]
+	autoname = names[0]
+	for name in names[1:]:
+		if autoname != name:
+			autoname = None
+	if facename == None:
+		facename = autoname
+	if facename == None:
+		raise FontError("fonts disagree on face name; "+\
+		"specify one with -facename")
+	return fon(facename, fnts)
+
+# The permissions a new file gets, for temporary files that are renamed
+# into place: mkstemp makes them private.
+umask = os.umask(0)
+os.umask(umask)
+
+def opentemp(outfile):
+	"""Create a uniquely named temporary file next to outfile, to be
+	renamed over it. Returns the file, open for writing, and its name."""
+	fd, tmp = tempfile.mkstemp(dir=os.path.dirname(outfile) or ".",
+		suffix=".tmp")
+	fp = os.fdopen(fd, "wb")
+	try:
+		os.chmod(tmp, 0o666 & ~umask)
+	except OSError:
+		fp.close()
+		os.remove(tmp)
+		raise
+	return fp, tmp
+
+def buildfile(outfile, infiles, fonmode=1, facename=None, cache=None,
+	dedup=None):
+	"""Compile .fd files into a .FNT or .FON file as build() does, but
+	write each font out as soon as it is compiled rather than holding
+	them all in memory. The output goes to a temporary file renamed
+	into place at the end, so on error outfile is left untouched.
+	Returns the size of the output."""
+	fp, tmp = opentemp(outfile)
+	try:
+		if fonmode == 0:
+			data = next(compile(infiles, facename, cache, dedup))
+			fp.write(data)
+			size = len(data)
+		else:
+			w = FonWriter(fp, len(infiles), facename)
+			for data in compile(infiles, facename, cache, dedup):
+				# If all supplied fonts have the same face name, use
+				# that. Otherwise, require that one be input.
+				if facename == None and w.name != None and \
+					fntfacename(data) != w.name:
+					raise FontError("fonts disagree on face name; "+\
+					"specify one with -facename")
+				w.add(data)
+			size = w.close()
+		fp.close()
+		os.replace(tmp, outfile)
+	except:
+		fp.close()
+		os.remove(tmp)
+		raise
+	return size
+
+if __name__ == "__main__":
+	if len(sys.argv) == 1:
+		print("usage: mkwinfont [-profile] [-pstats file] [-fnt | -fon] [-o outfile] [-facename name] [-cache dir] [-dedup | -incremental] files")
+		sys.exit(0)
+	args = sys.argv[1:]
+	if set(args) & set(["-profile", "--profile", "-pstats"]):
+		import winfontprof
+		try:
+			args = winfontprof.fromargs(args, sys.modules[__name__])
+		except ValueError as e:
+			sys.stderr.write(str(e)+"\n")
 			sys.exit(1)
-		outfp = open(outfile, "wb")
-		outfp.write(fon(facename, fnts))
-		outfp.close()
+	cache = None
+	dedup = None
+	try:
+		outfile, facename, fonmode, infiles, cachedir, dedup, incremental = \
+			parseargs(args)
+		if cachedir != None:
+			import winfontcache
+			cache = winfontcache.FntCache(cachedir)
+		if dedup:
+			dedup = Dedup()
+		else:
+			dedup = None
+		if incremental:
+			# winfontincr builds with mkwinfont: make that this module
+			# rather than a second copy of it.
+			sys.modules.setdefault("mkwinfont", sys.modules[__name__])
+			import winfontincr
+			winfontincr.buildfile(outfile, infiles, fonmode, facename, cache)
+		else:
+			buildfile(outfile, infiles, fonmode, facename, cache, dedup)
+	except FDError as e:
+		sys.stderr.write(str(e)+"\n")
+		sys.stderr.write("unable to load font description "+e.filename+"\n")
+		sys.exit(1)
+	except (ValueError, OSError) as e:
+		sys.stderr.write(str(e)+"\n")
+		sys.exit(1)
+
+	if cache != None:
+		sys.stderr.write(cache.stats()+"\n")
+	if dedup != None:
+		sys.stderr.write(dedup.stats()+"\n")
@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+
+# Glyph bitmap codec shared by mkwinfont and dewinfont.
+#
+# A .FNT file stores each glyph column-major: the first byte column
+# (the leftmost 8 pixels) for every row, then the next byte column,
+# and so on. Everything else in these scripts thinks in rows. This
+# module converts between the two for a whole batch of glyphs at once.
+#
+# Row-major buffers hold each glyph as height rows of widthbytes
+# bytes, most significant bit leftmost, glyphs back to back. Column
+# buffers hold the same glyphs in .FNT order.
+#
+# NumPy is used when it is installed and worth it; otherwise the same
+# transposes are done with strided slice assignment, which still
+# touches each byte once from C rather than from the Python loop.
+# Importing NumPy takes longer (well over 100 ms) than the slices take
+# over a whole font, so it is only imported for a batch of at least
+# numpymin bytes, where it saves more than that. Once it has been
+# imported, by this module or anything else, it is used for every
+# batch.
+
+import sys
+
+numpy = False # not looked for yet; None if it isn't installed
+
+# The smallest batch, in bytes, worth importing NumPy for.
+numpymin = 8 << 20
+
+def havenumpy():
+	"Return the numpy module, importing it the first time, or None."
+	global numpy
+	if numpy is False:
+		try:
+			import numpy as module
+		except ImportError:
+			module = None
+		numpy = module
+	return numpy
+
+def usenumpy(size):
+	"Return the numpy module if it's worth using on size bytes, or None."
+	if size <= 0:
+		return None
+	if numpy is False and size < numpymin and "numpy" not in sys.modules:
+		return None
+	return havenumpy()
+
+def rowstocols(rows, count, height, widthbytes):
+	"Transpose count row-major glyphs into .FNT column order."
+	size = height * widthbytes
+	if usenumpy(count * size) is not None:
+		a = numpy.frombuffer(rows, dtype=numpy.uint8, count=count*size)
+		a = a.reshape(count, height, widthbytes).transpose(0, 2, 1)
+		return a.tobytes()
+	out = bytearray(count * size)
+	if height * 4 <= count:
+		# Every glyph is the same size, so each (column, row) position
+		# is one strided slice across all of them, which is fewer and
+		# longer slices than going glyph by glyph unless the glyphs are
+		# tall.
+		block = rows[:count*size]
+		for k in range(widthbytes):
+			for y in range(height):
+				out[k*height+y::size] = block[y*widthbytes+k::size]
+		return bytes(out)
+	for g in range(count):
+		base = g * size
+		glyph = rows[base:base+size]
+		for k in range(widthbytes):
+			out[base+k*height:base+(k+1)*height] = glyph[k::widthbytes]
+	return bytes(out)
+
+def colstorows(buf, offsets, height, widthbytes):
+	"""Gather the .FNT column-order glyphs at offsets in buf, and return
+	them transposed into one row-major buffer."""
+	count = len(offsets)
+	size = height * widthbytes
+	if usenumpy(count * size) is not None:
+		a = numpy.frombuffer(buf, dtype=numpy.uint8)
+		idx = numpy.asarray(offsets, dtype=numpy.intp)[:, None, None] \
+			+ numpy.arange(height, dtype=numpy.intp)[None, :, None] \
+			+ numpy.arange(0, size, height, dtype=numpy.intp)[None, None, :]
+		return a[idx].tobytes()
+	out = bytearray(count * size)
+	for g in range(count):
+		off = offsets[g]
+		base = g * size
+		for k in range(widthbytes):
+			out[base+k:base+size:widthbytes] = buf[off+k*height:off+(k+1)*height]
+	return bytes(out)
+
+def blocktorows(buf, start, count, height, widthbytes):
+	"""Transpose count .FNT column-order glyphs lying back to back from
+	start in buf, as a fixed-pitch font's are, into row-major order."""
+	size = height * widthbytes
+	if usenumpy(count * size) is not None:
+		a = numpy.frombuffer(buf, dtype=numpy.uint8, count=count*size,
+			offset=start)
+		a = a.reshape(count, widthbytes, height).transpose(0, 2, 1)
+		return a.tobytes()
+	# With the glyphs evenly spaced, each (column, row) position is one
+	# strided slice across all of them.
+	block = buf[start:start+count*size]
+	out = bytearray(count * size)
+	for k in range(widthbytes):
+		for y in range(height):
+			out[y*widthbytes+k::size] = block[k*height+y::size]
+	return bytes(out)
+
+def packrows(data, width, widthbytes):
+	"Pack a list of row integers, width bits each, into row-major bytes."
+	shift = 8*widthbytes - width
+	mask = (1 << (8*widthbytes)) - 1
+	return b"".join([((d << shift) & mask).to_bytes(widthbytes, "big")
+		for d in data])
+
+def unpackrows(rows, width, widthbytes, base=0, height=None):
+	"Unpack row-major bytes into a list of row integers, width bits each."
+	if widthbytes == 0:
+		return [0] * (height or 0)
+	if height is None:
+		height = (len(rows) - base) // widthbytes
+	shift = 8*widthbytes - width
+	frombytes = int.from_bytes
+	return [frombytes(rows[p:p+widthbytes], "big") >> shift
+		for p in range(base, base + height*widthbytes, widthbytes)]
+
+def restride(rows, count, old, new):
+	"""Re-lay count rows of old bytes each as rows of new bytes, padding
+	with zero bytes or truncating on the right."""
+	out = bytearray(count * new)
+	for k in range(min(old, new)):
+		out[k::new] = rows[k:count*old:old]
+	return bytes(out)
@@ -0,0 +1,49 @@
+# The font tools as a library, for programs that import rather than run
+# them.
+#
+# winfont.reader decodes .FNT and .FON data into winfontmodel.Font
+# objects and .fd text; winfont.writer compiles .fd text into .FNT and
+# .FON data; winfont.aio decodes many files at once under asyncio.
+# None of them prints anything or exits: every problem with a font is
+# raised as a FontError, either a FontFormatError for a .FNT or .FON
+# that can't be read, or an FDError for a .fd description that can't
+# be compiled.
+#
+# Importing winfont itself loads nothing else. The submodules, and the
+# names below, are imported on first use, and NumPy only when a batch
+# of glyphs big enough to repay importing it is transposed (see
+# winbitmap), or if something else has already imported it.
+#
+# usage:
+#   import winfont
+#   fonts = winfont.reader.readfile("font.fon")
+#   data = winfont.writer.tofon(fonts)
+
+import importlib
+
+__all__ = ["reader", "writer", "aio", "Font", "FontError", "FontFormatError",
+	"FDError"]
+
+# Where each lazily imported name lives.
+lazy = {
+	"reader": ("winfont.reader", None),
+	"writer": ("winfont.writer", None),
+	"aio": ("winfont.aio", None),
+	"Font": ("winfontmodel", "Font"),
+	"FontError": ("winfontmodel", "FontError"),
+	"FontFormatError": ("dewinfont", "FontFormatError"),
+	"FDError": ("mkwinfont", "FDError"),
+}
+
+def __getattr__(name):
+	if name not in lazy:
+		raise AttributeError("module 'winfont' has no attribute %r" % name)
+	module, attr = lazy[name]
+	value = importlib.import_module(module)
+	if attr != None:
+		value = getattr(value, attr)
+	globals()[name] = value
+	return value
+
+def __dir__():
+	return sorted(list(globals()) + __all__)
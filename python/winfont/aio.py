@@ -0,0 +1,71 @@
+# Decoding many .FON and .FNT files at once, with asyncio.
+#
+# decompilefiles() reads files on a pool of threads, so that waiting
+# on a slow disk or network mount for one file overlaps with reading
+# others and with decoding the ones already read. The decoding (which
+# is dewinfont.readfonts, the core of dofon and dofnt) is handed to an
+# executor: the loop's default thread pool unless another is given,
+# such as a concurrent.futures.ProcessPoolExecutor to decode on every
+# CPU. At most `concurrency' files are in hand at once, read or being
+# decoded, however long the list of paths, and each is yielded as soon
+# as it is done, so callers can start on the first fonts before the
+# last file is read.
+#
+# usage:
+#   async for path, fonts, error in winfont.aio.decompilefiles(paths):
+#       ...
+
+import asyncio
+
+import dewinfont
+
+def readbytes(path):
+	"""Read a whole file. Unlike dewinfont.readfile this doesn't map it,
+	so that all the waiting for a slow file system happens here rather
+	than page by page when it is decoded."""
+	fp = open(path, "rb")
+	try:
+		return fp.read()
+	finally:
+		fp.close()
+
+async def decompilefile(path, executor=None, reader=None):
+	"Read and decode every font in one .FON or .FNT file."
+	loop = asyncio.get_running_loop()
+	data = await loop.run_in_executor(reader, readbytes, path)
+	return await loop.run_in_executor(executor, dewinfont.readfonts, data)
+
+async def decompilefiles(paths, concurrency=8, executor=None, reader=None):
+	"""Decode every font in each of some .FON and .FNT files, yielding
+	(path, fonts, None) for each file as it is done, in no particular
+	order, or (path, None, error) for a file that can't be read or
+	decoded. executor decodes, and reader, if given, reads."""
+	if concurrency < 1:
+		raise ValueError("concurrency must be at least 1")
+	paths = iter(paths)
+	pending = {}
+	def start():
+		for path in paths:
+			task = asyncio.ensure_future(decompilefile(path, executor, reader))
+			pending[task] = path
+			if len(pending) >= concurrency:
+				return
+	try:
+		start()
+		while pending:
+			done, rest = await asyncio.wait(pending,
+				return_when=asyncio.FIRST_COMPLETED)
+			for task in done:
+				path = pending.pop(task)
+				try:
+					fonts = task.result()
+					error = None
+				except (ValueError, OSError) as e:
+					fonts = None
+					error = e
+				yield path, fonts, error
+			start()
+	finally:
+		# The caller stopped early: don't leave work running.
+		for task in pending:
+			task.cancel()
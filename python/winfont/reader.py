@@ -0,0 +1,34 @@
+# Decoding .FNT and .FON data, as a library.
+#
+# These wrap dewinfont's raising functions: each returns its result or
+# raises dewinfont.FontFormatError, and none writes to stderr.
+
+import dewinfont
+
+FontFormatError = dewinfont.FontFormatError
+
+def readfonts(data, chars=None):
+	"""Decode every font in the contents of a .FON or .FNT file into a
+	list of winfontmodel.Font objects. With chars (a set or range of
+	char codes, say) only those chars' glyphs are decoded, and the rest
+	are left with zero width."""
+	return dewinfont.readfonts(data, chars)
+
+def readfile(path, chars=None):
+	"Decode every font in a .FON or .FNT file, or just some chars of each."
+	return readfonts(dewinfont.readfile(path), chars)
+
+def scan(data):
+	"""Return a winfontindex.FontInfo, with its header read but no glyphs
+	decoded, for each font in the contents of a .FON or .FNT file."""
+	import winfontindex
+	return winfontindex.index(data)
+
+def tofd(font):
+	"Return the .fd description of a Font as a string."
+	return "".join(dewinfont.fdchunks(font))
+
+def decompile(data):
+	"""Return the .fd description of every font in the contents of a
+	.FON or .FNT file, as a list of strings."""
+	return [tofd(f) for f in readfonts(data)]
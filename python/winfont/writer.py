@@ -0,0 +1,61 @@
+# Compiling .fd text into .FNT and .FON data, as a library.
+#
+# Sources are .fd text, not file names, so callers can compile what they
+# generate without writing it out first. Errors in a source are raised
+# as mkwinfont.FDError; .FON output whose fonts disagree on a face name
+# raises winfontmodel.FontError unless facename is given.
+#
+# A Compiler keeps the .FNT data it has compiled in memory, keyed by
+# source text, so a long-running caller rebuilding libraries from
+# mostly unchanged sources recompiles only what changed. An Incremental
+# goes further for one font being edited: it patches just the glyphs
+# whose text changed into the .FNT data it keeps.
+
+import mkwinfont
+import winfontcache
+import winfontincr
+
+FDError = mkwinfont.FDError
+Incremental = winfontincr.Incremental
+
+def parse(text):
+	"Parse .fd text into a winfontmodel.Font."
+	return mkwinfont.parsefont(text)
+
+def tofnt(font, dedup=0):
+	"""Return the contents of a .FNT file for a Font, storing identical
+	glyph bitmaps once if dedup is set."""
+	return mkwinfont.fnt(font, dedup)
+
+def tofon(fonts, facename=None, dedup=0):
+	"""Return the contents of a .FON file holding some Fonts, named
+	facename or else the face name they share."""
+	return mkwinfont.library([mkwinfont.fnt(f, dedup) for f in fonts],
+		facename)
+
+def compile(sources, fonmode=1, facename=None, cache=None, dedup=None):
+	"""Compile a list of .fd texts into the contents of a .FNT file
+	(fonmode 0, one source only) or a .FON file, using a winfontcache
+	cache if one is given, and sharing identical glyph bitmaps if
+	given a mkwinfont.Dedup."""
+	if fonmode == 0 and len(sources) != 1:
+		raise ValueError("FNT mode can only process one font")
+	fnts = [mkwinfont.compiletext(text, facename, cache, dedup)
+		for text in sources]
+	if fonmode == 0:
+		return fnts[0]
+	return mkwinfont.library(fnts, facename)
+
+class Compiler:
+	"Compiles .fd texts, remembering what it has compiled."
+
+	def __init__(self, maxsize=64 << 20):
+		self.cache = winfontcache.MemoryCache(maxsize)
+
+	def fnt(self, text, facename=None, dedup=None):
+		"Compile one .fd text into the contents of a .FNT file."
+		return mkwinfont.compiletext(text, facename, self.cache, dedup)
+
+	def compile(self, sources, fonmode=1, facename=None, dedup=None):
+		"Compile a list of .fd texts, as compile() does."
+		return compile(sources, fonmode, facename, self.cache, dedup)
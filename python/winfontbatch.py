@@ -0,0 +1,286 @@
+#!/usr/bin/python3
+
+# Run many mkwinfont and dewinfont conversions at once, across a pool
+# of worker processes, so a large batch pays for one interpreter
+# start-up per worker rather than one per font.
+#
+# Jobs come either from a manifest, one mkwinfont or dewinfont command
+# line per line:
+#
+#   # comments and blank lines are ignored
+#   mkwinfont -fon -o tektite.fon tektite16x9.fd tektite16x9oem.fd
+#   dewinfont -p extracted/tek tektite.fon
+#
+# (relative paths are taken relative to the manifest's directory; the
+# jobs run in no particular order, so none may read another's output),
+# or from walking directory trees: with -fnt or -fon every .fd file
+# found is compiled, and with -fd every .fon and .fnt file is
+# decompiled, each into the same relative place under the -o output
+# directory.
+
+import concurrent.futures
+import contextlib
+import io
+import os
+import shlex
+import sys
+import time
+
+import dewinfont
+import mkwinfont
+import winfontcache
+import winfontincr
+import winfontpack
+
+def mkjob(args):
+	"Run one mkwinfont command line. Returns (input bytes, output bytes)."
+	outfile, facename, fonmode, infiles, cachedir, dedup, incremental = \
+		mkwinfont.parseargs(args)
+	cache = None
+	if cachedir != None:
+		cache = winfontcache.FntCache(cachedir)
+	if dedup:
+		dedup = mkwinfont.Dedup()
+	else:
+		dedup = None
+	d = os.path.dirname(outfile)
+	if d:
+		os.makedirs(d, exist_ok=True)
+	if incremental:
+		winfontincr.buildfile(outfile, infiles, fonmode, facename, cache)
+		size = os.path.getsize(outfile)
+	else:
+		size = mkwinfont.buildfile(outfile, infiles, fonmode, facename, cache,
+			dedup)
+	return sum([os.path.getsize(f) for f in infiles]), size
+
+def dejob(args):
+	"Run one dewinfont command line. Returns (input bytes, output bytes)."
+	outfile, prefix, infile, packed = dewinfont.parseargs(args)
+	data = dewinfont.readfile(infile)
+	fonts = dewinfont.decompile(data)
+	if fonts == None:
+		raise ValueError("unable to read fonts from "+infile)
+	fnames = dewinfont.outnames(len(fonts), outfile, prefix,
+		".fdb" if packed else ".fd")
+	size = 0
+	for i in range(len(fonts)):
+		if packed:
+			out = winfontpack.dump(fonts[i])
+			writefile(fnames[i], out, "wb")
+		else:
+			out = "".join(dewinfont.fdchunks(fonts[i]))
+			writefile(fnames[i], out, "w")
+		size = size + len(out)
+	return len(data), size
+
+def writefile(fname, data, mode):
+	d = os.path.dirname(fname)
+	if d:
+		os.makedirs(d, exist_ok=True)
+	fp = open(fname, mode)
+	fp.write(data)
+	fp.close()
+
+tools = {"mkwinfont": mkjob, "dewinfont": dejob}
+
+def runjob(job):
+	"""Run a (tool, args) job, in a worker process. Returns (ok, message,
+	input bytes, output bytes); anything the tool writes to stderr is
+	collected into the message."""
+	tool, args = job
+	err = io.StringIO()
+	try:
+		with contextlib.redirect_stderr(err):
+			insize, outsize = tools[tool](args)
+	except Exception as e:
+		msg = err.getvalue() + str(e)
+		return 0, msg.strip(), 0, 0
+	return 1, err.getvalue().strip(), insize, outsize
+
+def readmanifest(fname):
+	"Read a manifest file into a list of (tool, args) jobs."
+	base = os.path.dirname(fname)
+	jobs = []
+	fp = open(fname, "r")
+	lineno = 0
+	for line in fp:
+		lineno = lineno + 1
+		words = shlex.split(line, comments=True)
+		if len(words) == 0:
+			continue
+		tool = os.path.basename(words[0])
+		if tool.endswith(".py"):
+			tool = tool[:-3]
+		if tool not in tools:
+			fp.close()
+			raise ValueError("%s:%d: unknown tool %s" % (fname, lineno, words[0]))
+		args = []
+		options = 1
+		words = words[1:]
+		while len(words) > 0:
+			w = words[0]
+			if options and w in ("-o", "-p", "-facename", "-cache") and \
+				len(words) > 1:
+				v = words[1]
+				if w != "-facename":
+					v = os.path.join(base, v)
+				args = args + [w, v]
+				words = words[2:]
+				continue
+			if options and w[0:1] == "-":
+				options = w != "--"
+			else:
+				w = os.path.join(base, w)
+			args.append(w)
+			words = words[1:]
+		jobs.append((tool, args))
+	fp.close()
+	return jobs
+
+def walkjobs(dirs, outdir, mode, facename, cachedir=None):
+	"""Make jobs for every convertible file under some directories.
+	mode is "-fnt" or "-fon" to compile .fd files, or "-fd" to
+	decompile .fon and .fnt files."""
+	if mode == "-fd":
+		exts = (".fon", ".fnt")
+	else:
+		exts = (".fd",)
+	jobs = []
+	for top in dirs:
+		for dirpath, dirnames, filenames in os.walk(top):
+			dirnames.sort()
+			for name in sorted(filenames):
+				stem, ext = os.path.splitext(name)
+				if ext.lower() not in exts:
+					continue
+				infile = os.path.join(dirpath, name)
+				out = os.path.normpath(os.path.join(outdir,
+					os.path.relpath(dirpath, top), stem))
+				if mode == "-fd":
+					jobs.append(("dewinfont", ["-o", out + ".fd", "-p", out,
+						"--", infile]))
+				else:
+					args = [mode, "-o", out + mode.replace("-", ".")]
+					if facename != None:
+						args = args + ["-facename", facename]
+					if cachedir != None:
+						args = args + ["-cache", cachedir]
+					jobs.append(("mkwinfont", args + ["--", infile]))
+	return jobs
+
+def runjobs(jobs, workers, report=sys.stdout):
+	"""Run jobs across a pool of worker processes (or in this process,
+	if workers is 1), reporting each one as it finishes. Returns the
+	number of failures."""
+	start = time.perf_counter()
+	failed = 0
+	insize = outsize = 0
+	def done(job, result):
+		ok, msg, i, o = result
+		tool, args = job
+		if tool == "mkwinfont" and "-o" in args[:-1]:
+			name = args[args.index("-o") + 1]
+		else:
+			name = args[-1]
+		if ok:
+			report.write("ok      " + name + "\n")
+		else:
+			report.write("FAILED  " + name + "\n")
+		if msg:
+			for line in msg.split("\n"):
+				report.write("        " + line + "\n")
+		return ok, i, o
+	if workers == 1:
+		results = [(job, runjob(job)) for job in jobs]
+		for job, result in results:
+			ok, i, o = done(job, result)
+			failed = failed + (not ok)
+			insize = insize + i
+			outsize = outsize + o
+	else:
+		with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+			futures = {}
+			for job in jobs:
+				futures[pool.submit(runjob, job)] = job
+			for future in concurrent.futures.as_completed(futures):
+				ok, i, o = done(futures[future], future.result())
+				failed = failed + (not ok)
+				insize = insize + i
+				outsize = outsize + o
+	elapsed = time.perf_counter() - start
+	rate = len(jobs) / elapsed if elapsed > 0 else 0
+	report.write("%d jobs, %d failed, in %.2f s (%.1f jobs/s, %.1f MB in, "
+		"%.1f MB out)\n" % (len(jobs), failed, elapsed, rate,
+		insize / 1e6, outsize / 1e6))
+	return failed
+
+if __name__ == "__main__":
+	a = sys.argv[1:]
+	workers = os.cpu_count() or 1
+	manifest = None
+	outdir = None
+	mode = None
+	facename = None
+	cachedir = None
+	dirs = []
+	if len(a) == 0:
+		print("usage: winfontbatch [-j N] -m manifest")
+		print("       winfontbatch [-j N] (-fnt | -fon) [-facename name] [-cache dir] -o outdir dirs")
+		print("       winfontbatch [-j N] -fd -o outdir dirs")
+		sys.exit(0)
+	while len(a) > 0:
+		if a[0] in ("-j", "-m", "-o", "-facename", "-cache"):
+			if len(a) < 2:
+				sys.stderr.write("option "+a[0]+" requires an argument\n")
+				sys.exit(1)
+			if a[0] == "-j":
+				try:
+					workers = int(a[1])
+				except ValueError:
+					workers = 0
+				if workers < 1:
+					sys.stderr.write("option -j requires a positive number\n")
+					sys.exit(1)
+			elif a[0] == "-m":
+				manifest = a[1]
+			elif a[0] == "-o":
+				outdir = a[1]
+			elif a[0] == "-cache":
+				cachedir = a[1]
+			else:
+				facename = a[1]
+			a = a[2:]
+		elif a[0] in ("-fnt", "-fon", "-fd"):
+			mode = a[0]
+			a = a[1:]
+		elif a[0][0:1] == "-":
+			sys.stderr.write("ignoring unrecognised option "+a[0]+"\n")
+			a = a[1:]
+		else:
+			dirs = dirs + [a[0]]
+			a = a[1:]
+
+	if manifest != None:
+		if dirs:
+			sys.stderr.write("give either a manifest or directories, not both\n")
+			sys.exit(1)
+		try:
+			jobs = readmanifest(manifest)
+		except ValueError as e:
+			sys.stderr.write(str(e)+"\n")
+			sys.exit(1)
+	else:
+		if not dirs:
+			sys.stderr.write("no manifest or input directories specified\n")
+			sys.exit(1)
+		if mode == None:
+			sys.stderr.write("directory mode needs one of -fnt, -fon or -fd\n")
+			sys.exit(1)
+		if outdir == None:
+			sys.stderr.write("directory mode needs an output directory (-o)\n")
+			sys.exit(1)
+		jobs = walkjobs(dirs, outdir, mode, facename, cachedir)
+
+	if runjobs(jobs, workers):
+		sys.exit(1)
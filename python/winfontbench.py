@@ -0,0 +1,538 @@
+#!/usr/bin/python3
+
+# Benchmarks for mkwinfont and dewinfont.
+#
+# By default this generates a deterministic corpus of synthetic .fd
+# fonts (glyph cells from 8x8 to 64x128, fixed and proportional pitch,
+# and FON libraries of 1 to 64 faces) and times each stage on it
+# separately: loadfont, fnt, dofnt and savefont per font, and fon,
+# nefon and pefon per library. For each it reports the best time,
+# throughput in MB and glyphs per second, and peak memory (measured
+# in a separate, traced run). -o saves the results as JSON, and
+# -compare prints them against an earlier JSON file, so that
+# regressions show up between commits. -corpus writes the .fd files
+# out instead, for use elsewhere.
+#
+# The codec stages run without NumPy loaded, as they do in the
+# command-line tools: once it is, winbitmap uses it on small fonts too.
+# Only the render stage of -fixed imports it, and that runs last.
+#
+# -fixed compares the fixed-pitch fast paths (.FNT decoding, rendering)
+# against the generic paths, on a fixed-pitch .fd font and on a copy
+# of it made proportional by blanking one char. .FNT encoding is timed
+# too, but has no fixed-pitch path: fnt() stores every glyph at the
+# same stride whatever the pitch, so it always encodes the font as one
+# block.
+#
+# -parse compares parsefont with the line-at-a-time parser mkwinfont
+# used to have (kept here as lineparse), on tektite16x9 and on a fixed
+# and a proportional font of each cell size. It prints the speed-up on
+# each, and exits with status 1 if parsefont's throughput over all of
+# them together is not at least parsetarget times lineparse's.
+#
+# usage: winfontbench [-quick] [-o results.json] [-compare old.json]
+#        winfontbench -corpus dir
+#        winfontbench -fixed [file.fd]
+#        winfontbench -parse
+
+import io
+import json
+import os
+import platform
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import dewinfont
+import mkwinfont
+import winbitmap
+
+# Glyph cells (width, height) of the single-font corpus, each generated
+# at fixed and at proportional pitch.
+cells = [(8, 8), (9, 16), (16, 32), (32, 64), (64, 128)]
+# FON libraries, as (cell, number of faces); each face gets its own
+# glyphs. They stay within the 1 MB or so that a .FON can address.
+libraries = [((8, 8), 1), ((8, 8), 16), ((8, 8), 64), ((9, 16), 32),
+	((16, 32), 8), ((64, 128), 1)]
+# The cases -quick keeps.
+quickcells = cells[:3]
+quicklibraries = libraries[:2] + [libraries[3]]
+
+def best(fn, repeat=20):
+	"Return the best time of repeat calls of fn, in seconds."
+	t = None
+	for i in range(repeat):
+		start = time.perf_counter()
+		fn()
+		elapsed = time.perf_counter() - start
+		if t == None or elapsed < t:
+			t = elapsed
+	return t
+
+def measure(fn, budget=0.25):
+	"""Time fn, repeating it (at least 3 and at most 50 times) for about
+	budget seconds. Returns the best time in seconds."""
+	t = None
+	total = 0
+	n = 0
+	while n < 3 or (total < budget and n < 50):
+		start = time.perf_counter()
+		fn()
+		elapsed = time.perf_counter() - start
+		if t == None or elapsed < t:
+			t = elapsed
+		total = total + elapsed
+		n = n + 1
+	return t
+
+def peak(fn):
+	"Run fn under tracemalloc and return its peak allocation in bytes."
+	tracemalloc.start()
+	try:
+		fn()
+		return tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+
+def genfd(width, height, fixed, seed, facename="Bench"):
+	"""Generate the .fd text of a synthetic font with glyph cells up to
+	width by height: every char width wide if fixed is set, or between
+	half and all of width otherwise. The pixels are random, but the
+	same for the same arguments."""
+	r = random.Random(seed)
+	pixels = str.maketrans("01", ".x")
+	out = ["# Synthetic font generated by winfontbench.\n\n"]
+	out.append("facename %s\ncopyright Public domain\n\n" % facename)
+	out.append("height %d\nascent %d\n" % (height, height - height // 4))
+	if not fixed:
+		out.append("weight 700\n")
+	out.append("\n")
+	for c in range(256):
+		if fixed:
+			w = width
+		else:
+			w = r.randint(max(width // 2, 1), width)
+		out.append("char %d\nwidth %d\n" % (c, w))
+		fmt = "0%db" % w
+		for y in range(height):
+			out.append(format(r.getrandbits(w), fmt).translate(pixels) + "\n")
+		out.append("\n")
+	return "".join(out)
+
+def casename(cell, fixed):
+	return "%dx%d%s" % (cell[0], cell[1], "f" if fixed else "p")
+
+def corpus(quick=0):
+	"""Generate the benchmark corpus. Returns (fonts, libraries): a list
+	of (name, .fd text) and a list of (name, [.fd text, ...])."""
+	fonts = []
+	for cell in (quickcells if quick else cells):
+		for fixed in (1, 0):
+			seed = cell[0] * 1000 + cell[1] * 10 + fixed
+			fonts.append((casename(cell, fixed),
+				genfd(cell[0], cell[1], fixed, seed)))
+	libs = []
+	for cell, faces in (quicklibraries if quick else libraries):
+		name = "%dx%dx%d" % (cell[0], cell[1], faces)
+		libs.append((name, [genfd(cell[0], cell[1], 0, 7919 * faces + i)
+			for i in range(faces)]))
+	return fonts, libs
+
+def pefile(fnts):
+	"""Wrap .FNT data in a minimal PE-format .FON, with nothing but a
+	resource section, so that dewinfont.pefon can be timed (mkwinfont
+	only writes NE)."""
+	n = len(fnts)
+	# The resource section: a root directory with one entry (type 8,
+	# fonts), a directory with one entry per font, a data entry per
+	# font, then the fonts themselves.
+	dirsize = 16 + 8
+	typesize = 16 + 8 * n
+	entries = dirsize + typesize
+	p = (entries + 16 * n + 15) &~ 15
+	rsrc = bytearray(p)
+	rva = 0x1000
+	dirtable = struct.Struct("<LLHHHH")
+	direntry = struct.Struct("<LL")
+	dirtable.pack_into(rsrc, 0, 0, 0, 0, 0, 0, 1)
+	direntry.pack_into(rsrc, 16, 8, 0x80000000 | dirsize)
+	dirtable.pack_into(rsrc, dirsize, 0, 0, 0, 0, 0, n)
+	for i in range(n):
+		direntry.pack_into(rsrc, dirsize + 16 + 8*i, i + 1,
+			entries + 16*i)
+		struct.pack_into("<LLLL", rsrc, entries + 16*i, rva + p,
+			len(fnts[i]), 0, 0)
+		rsrc.extend(fnts[i])
+		rsrc.extend(bytes(-len(rsrc) & 15))
+		p = len(rsrc)
+	head = bytearray(mkwinfont.stub())
+	peoff = len(head)
+	head.extend(b"PE\0\0" + struct.pack("<HHLLLHH", 0x14C, 1, 0, 0,
+		0, 0, 0x2102))
+	rawptr = (len(head) + 0x28 + 0x1FF) &~ 0x1FF
+	head.extend(struct.pack("<8sLLLL16x", b".rsrc", len(rsrc), rva,
+		len(rsrc), rawptr))
+	head.extend(bytes(rawptr - len(head)))
+	return bytes(head + rsrc), peoff
+
+def record(results, stage, case, fn, size, glyphs):
+	"Time and trace one stage on one case, and add it to results."
+	t = measure(fn)
+	results.append({"stage": stage, "case": case, "seconds": t,
+		"bytes": size, "glyphs": glyphs, "mb_per_s": size / t / 1e6,
+		"glyphs_per_s": glyphs / t, "peak_bytes": peak(fn)})
+
+def run(quick=0, report=sys.stdout):
+	"Generate the corpus and time every stage on it. Returns the results."
+	fonts, libs = corpus(quick)
+	results = []
+	tmp = tempfile.TemporaryDirectory()
+	try:
+		for name, text in fonts:
+			fname = os.path.join(tmp.name, name + ".fd")
+			fp = open(fname, "w")
+			fp.write(text)
+			fp.close()
+			f = mkwinfont.loadfont(fname)
+			data = mkwinfont.fnt(f)
+			g = dewinfont.dofnt(data)
+			record(results, "loadfont", name, lambda: mkwinfont.loadfont(fname),
+				len(text), 256)
+			record(results, "fnt", name, lambda: mkwinfont.fnt(f), len(data), 256)
+			record(results, "dofnt", name, lambda: dewinfont.dofnt(data),
+				len(data), 256)
+			record(results, "savefont", name,
+				lambda: dewinfont.savefont(g, io.StringIO()), len(text), 256)
+			report.write(".")
+			report.flush()
+		for name, texts in libs:
+			fnts = [mkwinfont.fnt(mkwinfont.parsefont(t)) for t in texts]
+			fon = mkwinfont.fon("Bench", fnts)
+			pe, peoff = pefile(fnts)
+			neoff = dewinfont.fromdword(fon, 0x3C)
+			glyphs = 256 * len(fnts)
+			record(results, "fon", name, lambda: mkwinfont.fon("Bench", fnts),
+				len(fon), glyphs)
+			record(results, "nefon", name, lambda: dewinfont.nefon(fon, neoff),
+				len(fon), glyphs)
+			record(results, "pefon", name, lambda: dewinfont.pefon(pe, peoff),
+				len(pe), glyphs)
+			report.write(".")
+			report.flush()
+	finally:
+		tmp.cleanup()
+	report.write("\n")
+	return results
+
+def commit():
+	"Return the git commit the benchmarks are run from, if known."
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+			capture_output=True, text=True, check=True,
+			cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def describe(results, report=sys.stdout):
+	report.write("%-9s %-10s %10s %9s %12s %10s\n" % ("stage", "case", "time",
+		"MB/s", "glyphs/s", "peak"))
+	for r in results:
+		report.write("%-9s %-10s %7.2f ms %9.1f %12.0f %7d KB\n" % (r["stage"],
+			r["case"], r["seconds"] * 1e3, r["mb_per_s"], r["glyphs_per_s"],
+			r["peak_bytes"] // 1024))
+
+def compare(results, old, report=sys.stdout):
+	"""Print each result's time against the same stage and case in an
+	older set of results. Returns the number more than 10% slower."""
+	before = {}
+	for r in old["results"]:
+		before[(r["stage"], r["case"])] = r
+	slower = 0
+	report.write("against %s:\n" % (old.get("meta", {}).get("commit") or
+		"earlier results"))
+	for r in results:
+		o = before.get((r["stage"], r["case"]))
+		if o == None:
+			continue
+		ratio = r["seconds"] / o["seconds"]
+		flag = ""
+		if ratio > 1.1:
+			flag = "  SLOWER"
+			slower = slower + 1
+		report.write("%-9s %-10s %7.2f ms -> %7.2f ms %6.2fx%s\n" %
+			(r["stage"], r["case"], o["seconds"] * 1e3, r["seconds"] * 1e3,
+			ratio, flag))
+	return slower
+
+# The speed-up over lineparse that parsefont was meant to reach.
+parsetarget = 5
+
+class LineFont:
+	pass
+
+class LineGlyph:
+	pass
+
+def lineparse(fp):
+	"""Read a .fd description from a file object a line at a time, as
+	mkwinfont's loadfont did before parsefont replaced it (the same
+	code, less its error messages). Returns a LineFont, each char's
+	rows a list of integers, or None on error. Kept only as a yardstick
+	for parsefont."""
+	f = LineFont()
+	f.copyright = f.facename = f.height = f.ascent = None
+	f.italic = f.underline = f.strikeout = 0
+	f.weight = 400
+	f.charset = 0
+	f.inleading = f.exleading = 0
+	f.pointsize = None
+	f.chars = [None] * 256
+	while 1:
+		s = fp.readline()
+		if s == "":
+			break
+		while s[-1:] == "\n" or s[-1:] == "\r":
+			s = s[:-1]
+		while s[0:1] == " ":
+			s = s[1:]
+		if s == "" or s[0:1] == "#":
+			continue
+		space = s.find(" ")
+		if space == -1:
+			space = len(s)
+		w = s[:space]
+		a = s[space+1:]
+		if w == "copyright":
+			if len(a) > 59:
+				return None
+			f.copyright = a
+			continue
+		if w == "height":
+			f.height = int(a)
+			continue
+		if w == "facename":
+			f.facename = a
+			continue
+		if w == "ascent":
+			f.ascent = int(a)
+			continue
+		if w == "inleading":
+			f.inleading = int(a)
+			continue
+		if w == "exleading":
+			f.exleading = int(a)
+			continue
+		if w == "pointsize":
+			f.pointsize = int(a)
+			continue
+		if w == "weight":
+			f.weight = int(a)
+			continue
+		if w == "charset":
+			f.charset = int(a)
+			continue
+		if w == "italic":
+			f.italic = a == "yes"
+			continue
+		if w == "underline":
+			f.underline = a == "yes"
+			continue
+		if w == "strikeout":
+			f.strikeout = a == "yes"
+			continue
+		if w == "char":
+			c = int(a)
+			y = 0
+			f.chars[c] = LineGlyph()
+			f.chars[c].width = 0
+			f.chars[c].data = [0] * f.height
+			continue
+		if w == "width":
+			f.chars[c].width = int(a)
+			continue
+		try:
+			w = w.translate({ord("."):"0", ord("-"):"0", ord("x"):"1",
+				ord("#"):"1"})
+			value = int(w, 2)
+			bits = len(w)
+			if bits < f.chars[c].width:
+				value = value << (f.chars[c].width - bits)
+			elif bits > f.chars[c].width:
+				value = value >> (bits - f.chars[c].width)
+			f.chars[c].data[y] = value
+			y = y + 1
+		except ValueError:
+			return None
+	if None in f.chars:
+		return None
+	return f
+
+def parsebench(report=sys.stdout, repeat=20):
+	"""Time parsefont against lineparse on a range of fonts. Returns true
+	if its throughput over all of them falls short of parsetarget."""
+	fname = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+		"fonts", "tektite16x9.fd")
+	fp = open(fname, "r")
+	fonts = [("tektite", fp.read())]
+	fp.close()
+	for cell in cells:
+		for fixed in (1, 0):
+			fonts.append((casename(cell, fixed), genfd(cell[0], cell[1], fixed,
+				cell[0] * 1000 + cell[1] * 10 + fixed)))
+	report.write("%-10s %12s %12s %8s\n" % ("font", "lineparse", "parsefont",
+		"speedup"))
+	oldtotal = newtotal = 0
+	for name, text in fonts:
+		if lineparse(io.StringIO(text)) == None:
+			raise ValueError("lineparse can't read " + name)
+		# Alternate the two, so that any drift in the machine's speed
+		# affects both alike.
+		old = new = None
+		for i in range(repeat):
+			t = best(lambda: lineparse(io.StringIO(text)), 1)
+			old = t if old == None else min(old, t)
+			t = best(lambda: mkwinfont.parsefont(text), 1)
+			new = t if new == None else min(new, t)
+		report.write("%-10s %9.2f ms %9.2f ms %7.1fx\n" % (name, old * 1e3,
+			new * 1e3, old / new))
+		oldtotal = oldtotal + old
+		newtotal = newtotal + new
+	report.write("%-10s %9.2f ms %9.2f ms %7.1fx (target %dx)\n" % ("all",
+		oldtotal * 1e3, newtotal * 1e3, oldtotal / newtotal, parsetarget))
+	return oldtotal / newtotal < parsetarget
+
+def proportional(source):
+	"""Turn the .fd text of a fixed-pitch font into a proportional one,
+	by making char 0 zero width."""
+	head, sep, rest = source.partition("\nchar 0\n")
+	rest = rest[rest.index("\nchar 1\n"):]
+	return head + sep + "width 0\n" + rest
+
+def codecstages(source):
+	"Time the .FNT stages on one font. Returns a list of (stage, seconds)."
+	f = mkwinfont.parsefont(source)
+	data = mkwinfont.fnt(f)
+	return [
+		("fnt", best(lambda: mkwinfont.fnt(f))),
+		("dofnt", best(lambda: dewinfont.dofnt(data))),
+	]
+
+def renderstage(source, text):
+	"Time rendering on one font. Returns (stage, seconds)."
+	import winfontrender
+	r = winfontrender.Renderer(mkwinfont.parsefont(source), cachesize=0)
+	return ("render", best(lambda: r.draw(text, 1)))
+
+def fixedbench(fname, report=sys.stdout):
+	"Compare the fixed-pitch paths with the generic ones on a font."
+	fp = open(fname, "r")
+	source = fp.read()
+	fp.close()
+	f = mkwinfont.parsefont(source)
+	if f.widths.count(f.widths[0]) != 256:
+		raise ValueError(fname + " is not a fixed-pitch font")
+	text = "The quick brown fox jumps over the lazy dog. " * 20
+	# A Renderer imports NumPy, after which winbitmap would use it for
+	# small fonts too, as the command-line tools don't: time the codec
+	# stages on both fonts first.
+	fixed = codecstages(source)
+	generic = codecstages(proportional(source))
+	if "numpy" in sys.modules:
+		report.write("(numpy was already loaded: the codec stages used it)\n")
+	fixed.append(renderstage(source, text))
+	generic.append(renderstage(proportional(source), text))
+	report.write("%-8s %12s %12s %8s\n" % ("stage", "fixed", "generic",
+		"speedup"))
+	for (stage, a), (stage, b) in zip(fixed, generic):
+		report.write("%-8s %9.3f ms %9.3f ms %7.1fx\n" % (stage, a * 1e3,
+			b * 1e3, b / a))
+	report.write("(fnt has no fixed-pitch path: every font is encoded as one "
+		"block)\n")
+
+if __name__ == "__main__":
+	a = sys.argv[1:]
+	quick = 0
+	outfile = None
+	oldfile = None
+	if a[0:1] == ["-fixed"]:
+		if len(a) > 1:
+			fname = a[1]
+		else:
+			fname = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+				"..", "fonts", "tektite16x9.fd")
+		try:
+			fixedbench(fname)
+		except (ValueError, OSError) as e:
+			sys.stderr.write(str(e)+"\n")
+			sys.exit(1)
+		sys.exit(0)
+	if a[0:1] == ["-parse"]:
+		try:
+			short = parsebench()
+		except (ValueError, OSError) as e:
+			sys.stderr.write(str(e)+"\n")
+			sys.exit(1)
+		sys.exit(1 if short else 0)
+	if a[0:1] == ["-corpus"]:
+		if len(a) != 2:
+			sys.stderr.write("option -corpus requires a directory\n")
+			sys.exit(1)
+		fonts, libs = corpus()
+		os.makedirs(a[1], exist_ok=True)
+		files = fonts + [("%s_%02d" % (name, i), texts[i])
+			for name, texts in libs for i in range(len(texts))]
+		for name, text in files:
+			fp = open(os.path.join(a[1], name + ".fd"), "w")
+			fp.write(text)
+			fp.close()
+		sys.exit(0)
+	while len(a) > 0:
+		if a[0] in ("-o", "-compare"):
+			if len(a) < 2:
+				sys.stderr.write("option "+a[0]+" requires an argument\n")
+				sys.exit(1)
+			if a[0] == "-o":
+				outfile = a[1]
+			else:
+				oldfile = a[1]
+			a = a[2:]
+		elif a[0] == "-quick":
+			quick = 1
+			a = a[1:]
+		else:
+			sys.stderr.write("usage: winfontbench [-quick] [-o results.json] [-compare old.json]\n")
+			sys.stderr.write("       winfontbench -corpus dir\n")
+			sys.stderr.write("       winfontbench -fixed [file.fd]\n")
+			sys.stderr.write("       winfontbench -parse\n")
+			sys.exit(1)
+
+	old = None
+	if oldfile != None:
+		try:
+			fp = open(oldfile, "r")
+			old = json.load(fp)
+			fp.close()
+		except (OSError, ValueError) as e:
+			sys.stderr.write(oldfile+": "+str(e)+"\n")
+			sys.exit(1)
+	results = run(quick)
+	# Whether winbitmap could have used NumPy on small inputs, which the
+	# command-line tools don't.
+	numpyloaded = "numpy" in sys.modules
+	describe(results)
+	if outfile != None:
+		meta = {"commit": commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+			"python": platform.python_version(), "platform": platform.platform(),
+			"numpyloaded": numpyloaded,
+			"numpy": winbitmap.havenumpy() and winbitmap.havenumpy().__version__,
+			"quick": quick}
+		fp = open(outfile, "w")
+		json.dump({"meta": meta, "results": results}, fp, indent=1)
+		fp.write("\n")
+		fp.close()
+	if old != None and compare(results, old):
+		sys.exit(1)
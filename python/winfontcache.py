@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+
+# On-disk cache of compiled .FNT data, for mkwinfont.
+#
+# Each entry is addressed by a hash of everything fnt() output depends
+# on: the .fd source bytes, mkwinfont's fntversion and the options that
+# change the result (the face name override and -dedup). So an
+# unchanged face is never re-parsed or re-encoded, and a stale entry
+# can't be hit; it just ages out.
+#
+# Entries live in <dir>/<2 hex digits>/<hash>.fnt. Every hit touches
+# the entry's mtime, and whenever a store takes the cache over its size
+# cap the least recently used entries are deleted, down to nine tenths
+# of the cap so that the next few stores fit. The cache's size is
+# found with one scan of the directory when a FntCache is made and
+# kept up to date as entries are stored, so the directory is only
+# walked again when it needs evicting. Writes go through a temporary
+# file and os.replace, so several processes can share a cache
+# directory (each may then overestimate the size until it next
+# evicts, which only makes it evict a little early).
+
+import collections
+import hashlib
+import os
+import tempfile
+
+def fntkey(source, version, facename=None, dedup=0):
+	"Return the cache key for some .fd source bytes and options."
+	h = hashlib.sha256()
+	h.update(("%s\0%r\0" % (version, facename)).encode("utf-8"))
+	if dedup:
+		h.update(b"dedup\0")
+	h.update(source)
+	return h.hexdigest()
+
+class FntCache:
+	"A size-capped, least-recently-used cache of compiled .FNT data."
+
+	def __init__(self, directory, maxsize=64 << 20):
+		self.directory = directory
+		self.maxsize = maxsize
+		self.hits = self.misses = self.stores = self.evictions = 0
+		self.size = sum([e[1] for e in self.entries()])
+
+	def key(self, source, version, facename=None, dedup=0):
+		"Return the cache key for some .fd source bytes and options."
+		return fntkey(source, version, facename, dedup)
+
+	def path(self, key):
+		return os.path.join(self.directory, key[:2], key + ".fnt")
+
+	def get(self, key):
+		"Return the cached data for a key, or None."
+		p = self.path(key)
+		try:
+			fp = open(p, "rb")
+		except OSError:
+			self.misses = self.misses + 1
+			return None
+		data = fp.read()
+		fp.close()
+		try:
+			os.utime(p)
+		except OSError:
+			pass # evicted meanwhile by another process; still a hit
+		self.hits = self.hits + 1
+		return data
+
+	def put(self, key, data):
+		"Store data under a key, then evict entries if over the cap."
+		p = self.path(key)
+		os.makedirs(os.path.dirname(p), exist_ok=True)
+		fd, tmp = tempfile.mkstemp(dir=os.path.dirname(p), suffix=".tmp")
+		try:
+			try:
+				os.write(fd, data)
+			finally:
+				os.close(fd)
+		except OSError:
+			os.remove(tmp)
+			raise
+		try:
+			self.size = self.size - os.path.getsize(p)
+		except OSError:
+			pass
+		os.replace(tmp, p)
+		self.size = self.size + len(data)
+		self.stores = self.stores + 1
+		if self.size > self.maxsize:
+			self.evict()
+
+	def entries(self):
+		"Return (mtime, size, path) for every entry, oldest first."
+		ret = []
+		try:
+			subdirs = os.scandir(self.directory)
+		except OSError:
+			return ret
+		for sub in subdirs:
+			if not sub.is_dir():
+				continue
+			for e in os.scandir(sub.path):
+				if e.name.endswith(".fnt"):
+					try:
+						st = e.stat()
+					except OSError:
+						continue
+					ret.append((st.st_mtime, st.st_size, e.path))
+		ret.sort()
+		return ret
+
+	def evict(self):
+		"""Delete least recently used entries until the cache is down to
+		nine tenths of its cap."""
+		entries = self.entries()
+		total = sum([e[1] for e in entries])
+		for mtime, size, p in entries:
+			if total <= self.maxsize * 9 // 10:
+				break
+			try:
+				os.remove(p)
+				self.evictions = self.evictions + 1
+			except OSError:
+				pass
+			total = total - size
+		self.size = total
+
+	def stats(self):
+		"Describe this cache object's hits and misses in one line."
+		n = self.hits + self.misses
+		rate = 100.0 * self.hits / n if n else 0.0
+		return "cache: %d hits, %d misses (%.0f%% hit rate), %d stored, " \
+			"%d evicted" % (self.hits, self.misses, rate, self.stores,
+			self.evictions)
+
+class MemoryCache:
+	"""An in-process, least-recently-used cache of compiled .FNT data,
+	with the same interface as FntCache, for long-running callers."""
+
+	def __init__(self, maxsize=64 << 20):
+		self.maxsize = maxsize
+		self.size = 0
+		self.data = collections.OrderedDict()
+		self.hits = self.misses = self.stores = self.evictions = 0
+
+	def key(self, source, version, facename=None, dedup=0):
+		"Return the cache key for some .fd source bytes and options."
+		return fntkey(source, version, facename, dedup)
+
+	def get(self, key):
+		"Return the cached data for a key, or None."
+		data = self.data.get(key)
+		if data == None:
+			self.misses = self.misses + 1
+			return None
+		self.data.move_to_end(key)
+		self.hits = self.hits + 1
+		return data
+
+	def put(self, key, data):
+		"Store data under a key, then evict entries if over the cap."
+		old = self.data.pop(key, None)
+		if old != None:
+			self.size = self.size - len(old)
+		self.data[key] = data
+		self.size = self.size + len(data)
+		self.stores = self.stores + 1
+		while self.size > self.maxsize and len(self.data) > 1:
+			key, old = self.data.popitem(last=False)
+			self.size = self.size - len(old)
+			self.evictions = self.evictions + 1
+
+	stats = FntCache.stats
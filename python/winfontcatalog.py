@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+
+# Catalog of the fonts in a directory tree of .FON and .FNT files.
+#
+# Building the catalog maps each file and runs winfontindex.scan over
+# it, which uses dewinfont's NE/PE resource walkers and reads only the
+# font headers. The result is saved as a JSON index next to the fonts
+# (or wherever -index says), keyed by file name and stamped with each
+# file's size and mtime, so a later build rescans only files that have
+# changed.
+#
+# Faces are kept sorted by (height, weight), overall and per face
+# name, so best() finds the nearest match with a couple of bisections
+# rather than a pass over every face. open() maps each file once and
+# hands back a winfontindex.FontInfo for the face, decoding nothing
+# until glyphs are asked for.
+#
+# usage: winfontcatalog [-index file] dir
+#        winfontcatalog [-index file] -height N [-bold | -weight N]
+#                       [-facename name] dir
+
+import bisect
+import json
+import os
+import sys
+
+import dewinfont
+import winfontindex
+
+indexversion = 1
+indexname = ".winfontcatalog.json"
+
+class Face:
+	"One font resource in the catalog."
+	__slots__ = ("file", "offset", "size", "facename", "height", "pointsize",
+		"weight", "italic", "charset", "firstchar", "lastchar")
+	fields = __slots__
+
+	def __init__(self, *values):
+		for name, value in zip(self.fields, values):
+			setattr(self, name, value)
+
+	def __repr__(self):
+		return "<Face %s:%#x %r %dpx weight %d>" % (self.file, self.offset,
+			self.facename, self.height, self.weight)
+
+	def values(self):
+		return [getattr(self, name) for name in self.fields]
+
+	def key(self):
+		return (self.height, self.weight)
+
+def scanfile(fname, relname):
+	"Return Faces for every font in a file, or None if it can't be read."
+	data = dewinfont.readfile(fname)
+	if len(data) == 0:
+		return None
+	fonts = winfontindex.scan(data)
+	if fonts == None:
+		return None
+	return [Face(relname, i.offset, len(i.data), i.facename, i.height,
+		i.pointsize, i.weight, int(i.italic), i.charset, i.firstchar,
+		i.lastchar) for i in fonts]
+
+class FaceList:
+	"Faces sorted by (height, weight), for nearest-match lookups."
+	__slots__ = ("faces", "keys", "heights")
+
+	def __init__(self, faces):
+		self.faces = sorted(faces, key=Face.key)
+		self.keys = [f.key() for f in self.faces]
+		self.heights = sorted(set([k[0] for k in self.keys]))
+
+	def best(self, height, weight):
+		"""Return the face nearest in height, then weight; on a tie, the
+		smaller. Returns None if the list is empty."""
+		if not self.heights:
+			return None
+		h = self.heights
+		p = bisect.bisect_left(h, height)
+		if p == len(h) or (p > 0 and height - h[p-1] <= h[p] - height):
+			p = p - 1
+		height = h[p]
+		lo = bisect.bisect_left(self.keys, (height, -1))
+		hi = bisect.bisect_left(self.keys, (height + 1, -1))
+		p = bisect.bisect_left(self.keys, (height, weight), lo, hi)
+		if p == hi or (p > lo and weight - self.keys[p-1][1] <=
+				self.keys[p][1] - weight):
+			p = p - 1
+		return self.faces[p]
+
+class Catalog:
+	"The fonts under a directory, indexed by their headers."
+
+	def __init__(self, directory, indexfile=None):
+		self.directory = directory
+		if indexfile == None:
+			indexfile = os.path.join(directory, indexname)
+		self.indexfile = indexfile
+		self.files = {}
+		self.maps = {}
+		self.scanned = 0
+		self.sort()
+
+	def load(self):
+		"Read the saved index, if there is a usable one."
+		try:
+			fp = open(self.indexfile, "r")
+			index = json.load(fp)
+			fp.close()
+		except (OSError, ValueError):
+			return
+		if index.get("version") != indexversion:
+			return
+		files = {}
+		for name, entry in index["files"].items():
+			files[name] = (entry["size"], entry["mtime"],
+				[Face(*values) for values in entry["faces"]])
+		self.files = files
+		self.sort()
+
+	def save(self):
+		"Write the index, atomically."
+		files = {}
+		for name, (size, mtime, faces) in self.files.items():
+			files[name] = {"size": size, "mtime": mtime,
+				"faces": [f.values() for f in faces]}
+		tmp = self.indexfile + ".tmp"
+		fp = open(tmp, "w")
+		json.dump({"version": indexversion, "fields": Face.fields,
+			"files": files}, fp, indent=0, sort_keys=True)
+		fp.close()
+		os.replace(tmp, self.indexfile)
+
+	def update(self):
+		"""Bring the index up to date with the directory, rescanning only
+		new or changed files. Returns the names of files that were
+		scanned and found unreadable; they stay in the index with no
+		faces, so they aren't rescanned until they change. Files that
+		can't be opened at all, such as dangling links, are returned too,
+		but left out of the index to be tried again next time."""
+		files = {}
+		bad = []
+		self.scanned = 0
+		for dirpath, dirnames, filenames in os.walk(self.directory):
+			dirnames.sort()
+			for name in sorted(filenames):
+				if os.path.splitext(name)[1].lower() not in (".fon", ".fnt"):
+					continue
+				fname = os.path.join(dirpath, name)
+				relname = os.path.relpath(fname, self.directory)
+				try:
+					st = os.stat(fname)
+				except OSError:
+					bad.append(relname)
+					continue
+				old = self.files.get(relname)
+				if old != None and old[0] == st.st_size and \
+					old[1] == st.st_mtime_ns:
+					files[relname] = old
+					continue
+				self.maps.pop(relname, None)
+				self.scanned = self.scanned + 1
+				try:
+					faces = scanfile(fname, relname)
+				except OSError:
+					bad.append(relname)
+					continue
+				if faces == None:
+					bad.append(relname)
+					faces = []
+				files[relname] = (st.st_size, st.st_mtime_ns, faces)
+		self.files = files
+		self.sort()
+		return bad
+
+	def sort(self):
+		self.all = FaceList(self.faces())
+		byname = {}
+		for f in self.all.faces:
+			byname.setdefault(f.facename.lower(), []).append(f)
+		self.byname = {}
+		for name, faces in byname.items():
+			self.byname[name] = FaceList(faces)
+
+	def faces(self):
+		"Return every face in the catalog."
+		ret = []
+		for name in sorted(self.files):
+			ret.extend(self.files[name][2])
+		return ret
+
+	def best(self, height, weight=400, facename=None):
+		"""Return the face nearest to a pixel height and weight, among
+		those with the given face name if there is one, or None."""
+		if facename != None:
+			faces = self.byname.get(facename.lower())
+			if faces == None:
+				return None
+			return faces.best(height, weight)
+		return self.all.best(height, weight)
+
+	def open(self, face):
+		"Return a winfontindex.FontInfo for a face, mapping its file once."
+		data = self.maps.get(face.file)
+		if data == None:
+			data = dewinfont.readfile(os.path.join(self.directory, face.file))
+			self.maps[face.file] = data
+		return winfontindex.FontInfo(memoryview(data)[face.offset:
+			face.offset+face.size], face.offset)
+
+def opencatalog(directory, indexfile=None):
+	"Load a directory's catalog, update it and save it if anything changed."
+	c = Catalog(directory, indexfile)
+	c.load()
+	before = set(c.files)
+	bad = c.update()
+	for name in bad:
+		sys.stderr.write("unable to read fonts from "+name+"\n")
+	if c.scanned or set(c.files) != before:
+		c.save()
+	return c
+
+if __name__ == "__main__":
+	a = sys.argv[1:]
+	indexfile = None
+	height = None
+	weight = 400
+	facename = None
+	directory = None
+	if len(a) == 0:
+		print("usage: winfontcatalog [-index file] dir")
+		print("       winfontcatalog [-index file] -height N [-bold | -weight N] [-facename name] dir")
+		sys.exit(0)
+	try:
+		while len(a) > 0:
+			if a[0] in ("-index", "-height", "-weight", "-facename"):
+				if len(a) < 2:
+					raise ValueError("option "+a[0]+" requires an argument")
+				if a[0] == "-index":
+					indexfile = a[1]
+				elif a[0] == "-height":
+					height = int(a[1])
+				elif a[0] == "-weight":
+					weight = int(a[1])
+				else:
+					facename = a[1]
+				a = a[2:]
+			elif a[0] == "-bold":
+				weight = 700
+				a = a[1:]
+			elif a[0][0:1] == "-":
+				sys.stderr.write("ignoring unrecognised option "+a[0]+"\n")
+				a = a[1:]
+			else:
+				if directory != None:
+					raise ValueError("one directory at once, please")
+				directory = a[0]
+				a = a[1:]
+		if directory == None:
+			raise ValueError("no directory specified")
+	except ValueError as e:
+		sys.stderr.write(str(e)+"\n")
+		sys.exit(1)
+
+	c = opencatalog(directory, indexfile)
+	if height == None:
+		for f in c.all.faces:
+			print("%s:%#x: %s %dpx %dpt weight %d charset %d chars %d-%d" %
+				(f.file, f.offset, f.facename, f.height, f.pointsize, f.weight,
+				f.charset, f.firstchar, f.lastchar))
+	else:
+		f = c.best(height, weight, facename)
+		if f == None:
+			sys.stderr.write("no matching face\n")
+			sys.exit(1)
+		print("%s:%#x: %s %dpx weight %d" % (f.file, f.offset, f.facename,
+			f.height, f.weight))
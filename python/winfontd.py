@@ -0,0 +1,369 @@
+#!/usr/bin/python3
+
+# A resident conversion server, so callers that aren't Python can
+# compile and decompile fonts without paying for an interpreter start-up
+# per request.
+#
+# Requests and responses are JSON objects, one per line, read from
+# stdin and written to stdout, or exchanged over a Unix socket with
+# -socket. Each request is handed to a pool of worker processes (or,
+# with -j 1, done in the server's own process); responses are written
+# as they finish, which need not be the order the requests came in, so
+# each carries back the request's "id".
+#
+#   {"id": 1, "op": "compile", "files": ["a.fd", "b.fd"], "format": "fon",
+#    "facename": "Name", "output": "out.fon"}
+#   {"id": 2, "op": "compile", "fd": ["<.fd text>"], "format": "fnt",
+#    "dedup": true}
+#   {"id": 3, "op": "decompile", "file": "font.fon"}
+#   {"id": 4, "op": "faces", "data": "<base64 .fon or .fnt>"}
+#   {"id": 5, "op": "stats"}
+#
+# compile takes .fd sources as file names ("files") or text ("fd"),
+# and writes the result to "output" or returns it base64-encoded as
+# "data"; with "dedup", identical glyph bitmaps are stored once and
+# "saved" says how many bytes that saved. decompile returns a list of
+# .fd texts as "fonts", and faces a list of header summaries, for the
+# .fon or .fnt in "file" or "data".
+# Every response has "ok", and either the result or an "error" message;
+# "ms" is the time from reading the request to writing the response.
+# stats returns counts and latencies per op, and the compile cache's
+# hit rate.
+#
+# The work is done by the same functions the command-line tools use:
+# mkwinfont's loadfont (or parsefont, for text), fnt and fon, and
+# dewinfont's readfonts, which dofon wraps. Each worker keeps the
+# .FNT data it compiles in a winfontcache.MemoryCache, and -cache adds
+# an on-disk winfontcache.FntCache that the workers share instead.
+#
+# usage: winfontd [-j N] [-cache dir] [-socket path]
+
+import base64
+import collections
+import concurrent.futures
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+
+import dewinfont
+import mkwinfont
+import winfontcache
+
+# Each worker's compile cache, made on its first request.
+cache = None
+
+def workercache(cachedir):
+	global cache
+	if cache == None:
+		if cachedir != None:
+			cache = winfontcache.FntCache(cachedir)
+		else:
+			cache = winfontcache.MemoryCache()
+	return cache
+
+def fontdata(request):
+	'The .fon or .fnt a request names in "file", or sends in "data".'
+	if "file" in request:
+		return dewinfont.readfile(request["file"])
+	return base64.b64decode(request["data"])
+
+def docompile(request, cache):
+	fonmode = {"fnt": 0, "fon": 1}.get(request.get("format", "fon"))
+	if fonmode == None:
+		raise ValueError("format must be \"fnt\" or \"fon\"")
+	facename = request.get("facename")
+	output = request.get("output")
+	dedup = None
+	if request.get("dedup"):
+		dedup = mkwinfont.Dedup()
+	if "files" in request:
+		field = "files"
+	else:
+		field = "fd"
+	sources = request[field]
+	if not isinstance(sources, list) or \
+		not all([isinstance(s, str) for s in sources]):
+		raise TypeError('"%s" must be a list of strings' % field)
+	if len(sources) == 0:
+		raise ValueError("no fonts to compile")
+	if fonmode == 0 and len(sources) > 1:
+		raise ValueError("FNT mode can only process one font")
+	if "files" in request and output != None:
+		size = mkwinfont.buildfile(output, sources, fonmode, facename, cache,
+			dedup)
+		return saving({"size": size}, dedup)
+	if "files" in request:
+		data = mkwinfont.build(sources, fonmode, facename, cache, dedup)
+	else:
+		fnts = [mkwinfont.compiletext(text, facename, cache, dedup)
+			for text in sources]
+		if fonmode == 0:
+			data = fnts[0]
+		else:
+			data = mkwinfont.library(fnts, facename)
+	if output != None:
+		fp, tmp = mkwinfont.opentemp(output)
+		try:
+			fp.write(data)
+			fp.close()
+			os.replace(tmp, output)
+		except:
+			fp.close()
+			os.remove(tmp)
+			raise
+		return saving({"size": len(data)}, dedup)
+	return saving({"size": len(data), "data": str(base64.b64encode(data),
+		encoding="ascii")}, dedup)
+
+def saving(response, dedup):
+	"Add what glyph sharing saved, if it was asked for, to a response."
+	if dedup != None:
+		response["saved"] = dedup.saved
+	return response
+
+def dodecompile(request, cache):
+	fonts = dewinfont.readfonts(fontdata(request))
+	return {"fonts": ["".join(dewinfont.fdchunks(f)) for f in fonts]}
+
+def dofaces(request, cache):
+	import winfontindex
+	faces = []
+	for i in winfontindex.index(fontdata(request)):
+		faces.append({"offset": i.offset, "facename": i.facename,
+			"height": i.height, "pointsize": i.pointsize, "weight": i.weight,
+			"italic": i.italic, "charset": i.charset,
+			"firstchar": i.firstchar, "lastchar": i.lastchar})
+	return {"faces": faces}
+
+def quiet():
+	"Leave interrupts to the server, which shuts the workers down."
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+ops = {"compile": docompile, "decompile": dodecompile, "faces": dofaces}
+
+def work(request, cachedir=None):
+	"""Carry out one request, in a worker. Returns the response, less its
+	id and latency, and how many compiled fonts came from the cache
+	and how many didn't."""
+	c = workercache(cachedir)
+	hits = c.hits
+	misses = c.misses
+	try:
+		response = ops[request["op"]](request, c)
+		response["ok"] = True
+	except (ValueError, OSError) as e:
+		response = {"ok": False, "error": str(e)}
+	except (KeyError, TypeError) as e:
+		response = {"ok": False, "error": "bad request: %s" % e}
+	return response, c.hits - hits, c.misses - misses
+
+class Metrics:
+	"Request counts and latencies, per op."
+
+	def __init__(self, keep=4096):
+		self.lock = threading.Lock()
+		self.keep = keep
+		self.counts = collections.Counter()
+		self.errors = collections.Counter()
+		self.latencies = {}
+		self.hits = self.misses = 0
+		self.start = time.perf_counter()
+
+	def record(self, op, ok, ms, hits=0, misses=0):
+		with self.lock:
+			self.counts[op] = self.counts[op] + 1
+			if not ok:
+				self.errors[op] = self.errors[op] + 1
+			if op not in self.latencies:
+				self.latencies[op] = collections.deque(maxlen=self.keep)
+			self.latencies[op].append(ms)
+			self.hits = self.hits + hits
+			self.misses = self.misses + misses
+
+	def stats(self):
+		"""Return the metrics as a dict: for each op, the number of
+		requests and errors and the mean, median, 99th percentile and
+		worst latency in ms over the most recent requests."""
+		with self.lock:
+			ops = {}
+			for op in sorted(self.counts):
+				t = sorted(self.latencies[op])
+				ops[op] = {"count": self.counts[op], "errors": self.errors[op],
+					"mean_ms": round(sum(t) / len(t), 3),
+					"p50_ms": round(t[len(t) // 2], 3),
+					"p99_ms": round(t[min(len(t) - 1, len(t) * 99 // 100)], 3),
+					"max_ms": round(t[-1], 3)}
+			return {"uptime_s": round(time.perf_counter() - self.start, 3),
+				"ops": ops, "cache_hits": self.hits,
+				"cache_misses": self.misses}
+
+	def describe(self):
+		"Summarise the metrics, one line per op."
+		s = self.stats()
+		lines = []
+		for op, m in s["ops"].items():
+			lines.append("%-10s %6d requests, %d failed, mean %.2f ms, "
+				"p50 %.2f ms, p99 %.2f ms, max %.2f ms" % (op, m["count"],
+				m["errors"], m["mean_ms"], m["p50_ms"], m["p99_ms"],
+				m["max_ms"]))
+		total = s["cache_hits"] + s["cache_misses"]
+		if total:
+			lines.append("compile cache: %d of %d fonts reused (%.0f%%)" %
+				(s["cache_hits"], total, 100.0 * s["cache_hits"] / total))
+		return "\n".join(lines)
+
+class Server:
+	"Hands requests to a pool of workers and reports on them."
+
+	def __init__(self, workers=1, cachedir=None):
+		self.cachedir = cachedir
+		if workers == 1:
+			self.pool = concurrent.futures.ThreadPoolExecutor(1)
+		else:
+			self.pool = concurrent.futures.ProcessPoolExecutor(workers,
+				initializer=quiet)
+		# Don't read requests much faster than the workers can take them.
+		self.slots = threading.BoundedSemaphore(4 * workers)
+		self.metrics = Metrics()
+
+	def submit(self, line, reply):
+		"""Start on one request line; reply is called with the response
+		line when it is done."""
+		start = time.perf_counter()
+		def finish(response, op, hits=0, misses=0):
+			ms = (time.perf_counter() - start) * 1000
+			response["ms"] = round(ms, 3)
+			self.metrics.record(op, response["ok"], ms, hits, misses)
+			reply(json.dumps(response) + "\n")
+		try:
+			request = json.loads(line)
+			if not isinstance(request, dict):
+				raise ValueError("request is not an object")
+		except ValueError as e:
+			finish({"id": None, "ok": False, "error": "bad request: %s" % e},
+				"invalid")
+			return
+		ident = request.get("id")
+		op = request.get("op")
+		if op == "stats":
+			response = self.metrics.stats()
+			response["id"] = ident
+			response["ok"] = True
+			finish(response, op)
+			return
+		if op not in ops:
+			finish({"id": ident, "ok": False, "error": "unknown op %r" % op},
+				"invalid")
+			return
+		self.slots.acquire()
+		def done(future):
+			self.slots.release()
+			try:
+				response, hits, misses = future.result()
+			except Exception as e:
+				response, hits, misses = {"ok": False, "error": str(e)}, 0, 0
+			response["id"] = ident
+			finish(response, op, hits, misses)
+		self.pool.submit(work, request, self.cachedir).add_done_callback(done)
+
+	def serve(self, infile, outfile):
+		"Answer request lines from a file until it ends."
+		lock = threading.Lock()
+		def reply(text):
+			with lock:
+				outfile.write(text)
+				outfile.flush()
+		for line in infile:
+			if line.strip():
+				self.submit(line, reply)
+
+	def close(self):
+		self.pool.shutdown()
+
+class Handler(socketserver.StreamRequestHandler):
+	"Answers the request lines on one socket connection."
+
+	def handle(self):
+		lock = threading.Lock()
+		pending = threading.Semaphore(0)
+		count = 0
+		def reply(text):
+			with lock:
+				try:
+					self.wfile.write(text.encode("utf-8"))
+				except OSError:
+					pass
+			pending.release()
+		for line in self.rfile:
+			if line.strip():
+				count = count + 1
+				self.server.winfontd.submit(str(line, encoding="utf-8"), reply)
+		# Finish what the client asked for before closing.
+		for i in range(count):
+			pending.acquire()
+
+def stop(signum, frame):
+	raise KeyboardInterrupt
+
+def serveunix(server, path):
+	"Answer requests on a Unix socket until interrupted."
+	if os.path.exists(path):
+		os.remove(path)
+	s = socketserver.ThreadingUnixStreamServer(path, Handler)
+	s.daemon_threads = True
+	s.winfontd = server
+	try:
+		s.serve_forever()
+	finally:
+		s.server_close()
+		os.remove(path)
+
+if __name__ == "__main__":
+	a = sys.argv[1:]
+	workers = os.cpu_count() or 1
+	cachedir = None
+	socketpath = None
+	while len(a) > 0:
+		if a[0] in ("-j", "-cache", "-socket"):
+			if len(a) < 2:
+				sys.stderr.write("option "+a[0]+" requires an argument\n")
+				sys.exit(1)
+			if a[0] == "-j":
+				try:
+					workers = int(a[1])
+				except ValueError:
+					workers = 0
+				if workers < 1:
+					sys.stderr.write("option -j requires a positive number\n")
+					sys.exit(1)
+			elif a[0] == "-cache":
+				cachedir = a[1]
+			else:
+				socketpath = a[1]
+			a = a[2:]
+		elif a[0] in ("-h", "-help", "--help"):
+			print("usage: winfontd [-j N] [-cache dir] [-socket path]")
+			sys.exit(0)
+		else:
+			sys.stderr.write("ignoring unrecognised argument "+a[0]+"\n")
+			a = a[1:]
+
+	signal.signal(signal.SIGTERM, stop)
+	server = Server(workers, cachedir)
+	try:
+		if socketpath != None:
+			serveunix(server, socketpath)
+		else:
+			server.serve(sys.stdin, sys.stdout)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.close()
+		report = server.metrics.describe()
+		if report:
+			sys.stderr.write(report + "\n")
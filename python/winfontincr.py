@@ -0,0 +1,311 @@
+#!/usr/bin/python3
+
+# Incremental recompilation of .fd files, one glyph at a time.
+#
+# The .fd text is cut into segments at its "char" lines: the header
+# (everything before the first char) and one segment per char. When a
+# new version of the text arrives, only segments whose text changed
+# are looked at. If the header and the list of chars are the same, and
+# every changed char keeps its width (so no bitmap moves and the
+# stride stays put), each changed char's rows are parsed on their own
+# and its bitmap written over the old one where the .FNT's char table
+# says it lies. Anything else (a header edit, a char added, removed or
+# reordered, a width change, or a segment that isn't just a char's
+# width and rows) falls back to compiling the whole font, which also
+# reports any errors.
+#
+# Incremental keeps a font and its .FNT data in memory, for an editor
+# to preview edits. buildfile() does the same for mkwinfont
+# -incremental: it remembers hashes of the last build's segments in
+# outfile.incr, next to the output, and patches the changed bitmaps
+# straight into the .FNT or .FON file.
+#
+# usage: mkwinfont -incremental [-fnt | -fon] -o outfile files
+
+import hashlib
+import json
+import mmap
+import os
+import re
+
+import dewinfont
+import mkwinfont
+import winbitmap
+
+incrversion = 1
+
+# Where a segment starts: the newline before a char line.
+charline = re.compile(r"\n *char ")
+
+def digest(text):
+	return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+def normalise(text):
+	"Put .fd text in the form parsefont works on."
+	if "\r" in text:
+		text = text.replace("\r\n", "\n").replace("\r", "\n")
+	return "\n" + text + "\n"
+
+def segments(text):
+	"""Cut normalised .fd text into its header and char segments.
+	Returns the header and a list of the char segments."""
+	starts = [m.start() for m in charline.finditer(text)]
+	if not starts:
+		return text, []
+	ends = starts[1:] + [len(text)]
+	return text[:starts[0]], [text[a:b] for a, b in zip(starts, ends)]
+
+def layout(text):
+	"""Return the header of normalised .fd text, and the char number and
+	text of each char segment, or None for the chars if they aren't
+	each a distinct char number in a line of its own."""
+	header, chars = segments(text)
+	numbers = []
+	for s in chars:
+		try:
+			numbers.append(int(s[:s.index("\n", 1)].split()[1]))
+		except (ValueError, IndexError):
+			return header, None
+	if len(set(numbers)) != len(numbers):
+		return header, None
+	return header, list(zip(numbers, chars))
+
+def stored(text):
+	"""Return the layout of normalised .fd text as it is saved, with
+	hashes in place of the text."""
+	header, chars = layout(text)
+	if chars != None:
+		chars = [[n, digest(segment)] for n, segment in chars]
+	return [digest(header), chars]
+
+def parseglyph(segment, height, stride):
+	"""Parse one char segment on its own. Returns the char number, its
+	width and its rows in store layout (height rows of stride bytes).
+	Raises ValueError if the segment is anything more than a char line,
+	a width line, comments and bitmap rows, or IndexError on a bad row,
+	so that the caller can leave it to parsefont to report."""
+	c = None
+	width = 0
+	rows = []
+	spans = []
+	prev = 0
+	text = segment + "\n"
+	for m in mkwinfont.fdmark.finditer(text):
+		indent, w, a = m.groups()
+		if indent and w[:1] in mkwinfont.fdrowstart:
+			continue
+		if m.start() > prev + 1:
+			prev = mkwinfont.fdrows(text, prev, m.start(),
+				rows if c != None else None, spans)
+		prev = m.end()
+		if w == "" or w[0] == "#":
+			continue
+		if w == "char" and c == None:
+			c = int(a)
+		elif w == "width" and c != None:
+			width = int(a)
+		else:
+			raise ValueError("not just a char")
+	if len(text) > prev + 1:
+		mkwinfont.fdrows(text, prev, len(text), rows, spans)
+	if c == None:
+		raise ValueError("no char")
+	bits = 8 * stride
+	if width > bits:
+		raise ValueError("too wide")
+	chunk = mkwinfont.fdglyph(rows, width, height, bits)
+	if width == 0:
+		return c, 0, bytes(height * stride)
+	value = int(chunk.encode("ascii", "replace").translate(mkwinfont.fdbytes)
+		or b"0", 2)
+	return c, width, value.to_bytes(height * stride, "big")
+
+def glyphoffset(data, base, i):
+	"Return where char i's bitmap lies in .FNT data starting at base."
+	return base + mkwinfont.fromdword(data[base+0x94+6*i+2:base+0x94+6*i+6])
+
+def changes(old, new, widths, height, stride, key=None):
+	"""Work out the glyphs to patch to go from one layout to another,
+	the old one given by key(text) of its header and segments if there
+	is a key. Returns a list of (char, rows), or None if it can't be
+	done that way."""
+	if key == None:
+		key = lambda text: text
+	oldheader, oldchars = old
+	newheader, newchars = new
+	if oldchars == None or newchars == None or \
+		[c[0] for c in oldchars] != [c[0] for c in newchars] or \
+		oldheader != key(newheader):
+		return None
+	patches = []
+	for k in range(len(newchars)):
+		n, segment = newchars[k]
+		if oldchars[k][1] == key(segment):
+			continue
+		try:
+			c, width, rows = parseglyph(segment, height, stride)
+		except (ValueError, IndexError):
+			return None
+		if c != n or width != widths[n]:
+			return None
+		patches.append((n, rows))
+	return patches
+
+class Incremental:
+	"""A font compiled from .fd text, kept up to date with new versions
+	of the text by recompiling only the chars that changed."""
+
+	def __init__(self, text, facename=None):
+		"Compile some .fd text. Raises FDError if it can't be."
+		self.facename = facename
+		self.rebuild(normalise(text))
+
+	def rebuild(self, text):
+		f = mkwinfont.parsefont(text[1:-1])
+		if self.facename != None:
+			f.facename = self.facename
+		self.font = f
+		self.data = bytearray(mkwinfont.fnt(f))
+		self.layout = layout(text)
+
+	def update(self, text):
+		"""Bring the font up to date with a new version of its text.
+		Returns the chars whose bitmaps were patched, or None if the
+		whole font had to be recompiled. Raises FDError if the text
+		can't be compiled, leaving the font as it was."""
+		text = normalise(text)
+		new = layout(text)
+		f = self.font
+		patches = changes(self.layout, new, f.widths, f.height, f.stride)
+		if patches == None:
+			self.rebuild(text)
+			return None
+		size = f.glyphsize
+		for n, rows in patches:
+			f.bits[n*size:(n+1)*size] = rows
+			p = glyphoffset(self.data, 0, n)
+			self.data[p:p+size] = winbitmap.rowstocols(rows, 1, f.height,
+				f.stride)
+		self.layout = new
+		return [n for n, rows in patches]
+
+	def fnt(self):
+		"Return the current .FNT data."
+		return bytes(self.data)
+
+def statefile(outfile):
+	return outfile + ".incr"
+
+def loadstate(outfile):
+	"Return the state saved by the last incremental build, or None."
+	try:
+		fp = open(statefile(outfile), "r")
+		state = json.load(fp)
+		fp.close()
+		st = os.stat(outfile)
+	except (OSError, ValueError):
+		return None
+	if state.get("version") != incrversion or \
+		state.get("fntversion") != mkwinfont.fntversion or \
+		state.get("size") != st.st_size or state.get("mtime") != st.st_mtime_ns:
+		return None
+	return state
+
+def savestate(outfile, state):
+	st = os.stat(outfile)
+	state["size"] = st.st_size
+	state["mtime"] = st.st_mtime_ns
+	tmp = statefile(outfile) + ".tmp"
+	fp = open(tmp, "w")
+	json.dump(state, fp)
+	fp.close()
+	os.replace(tmp, statefile(outfile))
+
+def readtext(fname):
+	fp = open(fname, "r")
+	try:
+		return normalise(fp.read())
+	finally:
+		fp.close()
+
+def buildfile(outfile, infiles, fonmode=1, facename=None, cache=None):
+	"""Compile .fd files into a .FNT or .FON file as mkwinfont.buildfile
+	does, but if the last build of outfile was incremental too, patch
+	only the glyphs that changed since into it. Returns the chars
+	patched in each font, or None if it was built from scratch."""
+	state = loadstate(outfile)
+	texts = None
+	if state != None and state["files"] == infiles and \
+		state["fonmode"] == fonmode and state["facename"] == facename:
+		try:
+			texts = [readtext(fname) for fname in infiles]
+		except (OSError, UnicodeDecodeError):
+			texts = None
+	if texts != None:
+		patched = patch(outfile, state, texts)
+		if patched != None:
+			state["layouts"] = [stored(text) for text in texts]
+			savestate(outfile, state)
+			return patched
+	mkwinfont.buildfile(outfile, infiles, fonmode, facename, cache)
+	state = {"version": incrversion, "fntversion": mkwinfont.fntversion,
+		"files": infiles, "fonmode": fonmode, "facename": facename}
+	try:
+		texts = [readtext(fname) for fname in infiles]
+	except UnicodeDecodeError:
+		# A packed font: nothing to patch next time.
+		texts = None
+	if texts != None and fonmode != 0:
+		data = dewinfont.readfile(outfile)
+		bases = [start for start, size in dewinfont.findfonts(data)]
+		if isinstance(data, mmap.mmap):
+			data.close()
+		if len(bases) != len(infiles) or len(set(bases)) != len(bases):
+			# Identical fonts share one copy in a .FON: patching one
+			# would change both.
+			texts = None
+	else:
+		bases = [0]
+	if texts == None:
+		try:
+			os.remove(statefile(outfile))
+		except OSError:
+			pass
+		return None
+	state["bases"] = bases
+	state["layouts"] = [stored(text) for text in texts]
+	savestate(outfile, state)
+	return None
+
+def patch(outfile, state, texts):
+	"""Patch the changed glyphs of each font into outfile. Returns the
+	chars patched in each font, or None if that can't be done, in
+	which case outfile is left untouched."""
+	data = dewinfont.readfile(outfile)
+	try:
+		writes = []
+		patched = []
+		for k in range(len(texts)):
+			base = state["bases"][k]
+			height = mkwinfont.fromword(data[base+0x58:base+0x5A])
+			stride = mkwinfont.fromword(data[base+0x63:base+0x65])
+			widths = [mkwinfont.fromword(data[base+0x94+6*i:base+0x96+6*i])
+				for i in range(256)]
+			p = changes(state["layouts"][k], layout(texts[k]), widths, height,
+				stride, digest)
+			if p == None:
+				return None
+			for n, rows in p:
+				writes.append((glyphoffset(data, base, n),
+					winbitmap.rowstocols(rows, 1, height, stride)))
+			patched.append([n for n, rows in p])
+	finally:
+		if isinstance(data, mmap.mmap):
+			data.close()
+	if writes:
+		fp = open(outfile, "r+b")
+		for p, cols in writes:
+			fp.seek(p)
+			fp.write(cols)
+		fp.close()
+	return patched
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+
+# Lazy, header-only view of the fonts in a .FON or .FNT file.
+#
+# dewinfont.decompile decodes every glyph of every font up front. To
+# list the faces in a file, or to look at a handful of glyphs, scan()
+# instead finds the font resources (with dewinfont's NE and PE walkers)
+# and reads only each one's fixed header. The returned FontInfo
+# handles keep a memoryview of their .FNT data; a glyph's char table
+# entry is read, and its bitmap transposed, only when that glyph is
+# asked for, and font(chars) decodes just the glyphs for some chars.
+#
+# usage: winfontindex file [file ...]
+# prints one line per face: file, index, face name, height, point size,
+# weight, charset and char range.
+
+import array
+import struct
+import sys
+
+import dewinfont
+import winbitmap
+from winfontmodel import NCHARS
+
+# The part of the .FNT header that versions 2 and 3 share, up to and
+# including dfReserved.
+fntheader = struct.Struct("<HL60sHHHHHHHBBBHBHHBHHBBBBHLLLLB")
+
+class FontInfo:
+	"The header of one .FNT resource, with its glyphs decoded on demand."
+	__slots__ = ("data", "offset", "version", "copyright", "facename",
+		"pointsize", "ascent", "inleading", "exleading", "italic",
+		"underline", "strikeout", "weight", "charset", "pixwidth", "height",
+		"avgwidth", "maxwidth", "firstchar", "lastchar", "defaultchar",
+		"breakchar", "_table")
+
+	def __init__(self, data, offset=0):
+		"""Read the header of the .FNT data in a buffer; offset records
+		where in its file it came from. Raises dewinfont.FontFormatError
+		if it can't be read as a bitmap font."""
+		data = memoryview(data)
+		if len(data) < fntheader.size:
+			raise dewinfont.FontFormatError("Font header truncated")
+		(self.version, size, copyright, ftype, self.pointsize, vres, hres,
+			self.ascent, self.inleading, self.exleading, self.italic,
+			self.underline, self.strikeout, self.weight, self.charset,
+			self.pixwidth, self.height, family, self.avgwidth,
+			self.maxwidth, self.firstchar, self.lastchar, self.defaultchar,
+			self.breakchar, widthbytes, device, off_facename, bitspointer,
+			bitsoffset, reserved) = fntheader.unpack_from(data)
+		if ftype & 1:
+			raise dewinfont.FontFormatError("This font is a vector font")
+		if off_facename > len(data):
+			raise dewinfont.FontFormatError(
+				"Face name not contained within font data")
+		self.data = data
+		self.offset = offset
+		self.italic = self.italic != 0
+		self.underline = self.underline != 0
+		self.strikeout = self.strikeout != 0
+		self.facename = str(dewinfont.ascizat(data, off_facename),
+			encoding="windows-1252", errors="replace")
+		self.copyright = str(dewinfont.asciz(copyright), encoding="windows-1252",
+			errors="replace")
+		self._table = None
+
+	def __repr__(self):
+		return "<FontInfo %r %dpx at %#x>" % (self.facename, self.height,
+			self.offset)
+
+	def table(self):
+		"""Return the char table as two arrays indexed by char: widths
+		and bitmap offsets, zero for chars outside the font's range."""
+		if self._table == None:
+			widths = array.array("H", bytes(2 * NCHARS))
+			offsets = array.array("L", [0]) * NCHARS
+			if self.version == 0x200:
+				entry = struct.Struct("<HH")
+				start = 0x76
+			else:
+				entry = struct.Struct("<HL")
+				start = 0x94
+			n = self.lastchar - self.firstchar + 1
+			i = self.firstchar
+			for w, off in entry.iter_unpack(self.data[start:start+n*entry.size]):
+				widths[i] = w
+				offsets[i] = off
+				i = i + 1
+			self._table = widths, offsets
+		return self._table
+
+	@property
+	def widths(self):
+		return self.table()[0]
+
+	def entry(self, i):
+		"""Return char i's width and bitmap offset, reading just its char
+		table entry if the whole table hasn't been read."""
+		if self._table != None:
+			return self._table[0][i], self._table[1][i]
+		if i < self.firstchar or i > self.lastchar:
+			return 0, 0
+		if self.version == 0x200:
+			return struct.unpack_from("<HH", self.data,
+				0x76 + 4 * (i - self.firstchar))
+		return struct.unpack_from("<HL", self.data,
+			0x94 + 6 * (i - self.firstchar))
+
+	def glyphrows(self, i):
+		"""Return char i's bitmap as row-major bytes, (width+7)//8 bytes
+		per row, leftmost pixel in the top bit."""
+		width, offset = self.entry(i)
+		widthbytes = (width + 7) // 8
+		if widthbytes == 0:
+			return b""
+		return winbitmap.colstorows(self.data, [offset], self.height,
+			widthbytes)
+
+	def glyph(self, i):
+		"Return char i's rows as a list of integers, width bits each."
+		width = self.entry(i)[0]
+		return winbitmap.unpackrows(self.glyphrows(i), width,
+			(width + 7) // 8, 0, self.height)
+
+	def font(self, chars=None):
+		"""Decode the font into a winfontmodel.Font, as dewinfont does:
+		all of it, or just the glyphs for chars (a set or range of char
+		codes, say), leaving the rest with zero width."""
+		if chars == None:
+			return dewinfont.dofnt(self.data)
+		return dewinfont.readfnt(self.data, chars)
+
+def scan(data):
+	"""Return a FontInfo for each font in the contents of a .FON or .FNT
+	file, or None if it can't be read."""
+	return dewinfont.quietly(index, data)
+
+def index(data):
+	"""Return a FontInfo for each font in the contents of a .FON or .FNT
+	file. Raises dewinfont.FontFormatError if it can't be read."""
+	if dewinfont.isfon(data):
+		resources = dewinfont.findfonts(data)
+	else:
+		resources = [(0, len(data))]
+	data = memoryview(data)
+	ret = []
+	for start, size in resources:
+		try:
+			ret.append(FontInfo(data[start:start+size], start))
+		except (ValueError, struct.error) as e:
+			raise dewinfont.FontFormatError("%s (font resource at %x)" %
+				(e, start))
+	return ret
+
+def describe(info):
+	"Summarise a FontInfo in one line."
+	return "%s %dpx %dpt weight %d charset %d chars %d-%d" % (info.facename,
+		info.height, info.pointsize, info.weight, info.charset,
+		info.firstchar, info.lastchar)
+
+if __name__ == "__main__":
+	if len(sys.argv) == 1:
+		print("usage: winfontindex file [file ...]")
+		sys.exit(0)
+	status = 0
+	for infile in sys.argv[1:]:
+		try:
+			data = dewinfont.readfile(infile)
+		except OSError as e:
+			sys.stderr.write(str(e)+"\n")
+			status = 1
+			continue
+		fonts = scan(data)
+		if fonts == None:
+			sys.stderr.write("unable to read fonts from "+infile+"\n")
+			status = 1
+			continue
+		for i in range(len(fonts)):
+			print("%s:%d: %s" % (infile, i, describe(fonts[i])))
+	sys.exit(status)
@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+
+# In-memory font description shared by mkwinfont and dewinfont.
+#
+# A Font keeps its header fields in slots, the 256 glyph widths in one
+# array and every glyph bitmap in one contiguous row-major bytearray
+# (see winbitmap): glyph i occupies height rows of `stride' bytes
+# starting at i * height * stride, pixels left-aligned, bits beyond
+# the glyph's width always zero. The stride follows the .FNT
+# dfWidthBytes rule for the widest glyph, so fnt() can usually hand
+# the store straight to the transposer.
+#
+# Glyphs are not stored as objects at all: font.chars[i] returns a
+# small Glyph handle naming the font and the index, whose width and
+# data attributes read and write the shared store.
+
+import array
+import winbitmap
+
+NCHARS = 256
+
+class FontError(ValueError):
+	"A font, or a description of one, that the tools can't handle."
+
+def widthbytes(width):
+	"Bytes per row for a glyph of the given width, rounded as .FNT does."
+	return ((width - 1) // 16 + 1) * 2
+
+# Tables to clear the bits to the right of a glyph in its last, partial
+# byte column, indexed by the number of pixels used in that column.
+clipmasks = [bytes([b & (0xFF00 >> n) for b in range(256)]) for n in range(8)]
+
+class Font:
+	"A bitmap font description."
+	__slots__ = ("copyright", "facename", "height", "ascent", "pointsize",
+		"italic", "underline", "strikeout", "weight", "charset",
+		"inleading", "exleading", "stride", "widths", "bits")
+
+	def __init__(self):
+		self.copyright = self.facename = self.height = self.ascent = None
+		self.italic = self.underline = self.strikeout = 0
+		self.weight = 400
+		self.charset = 0
+		self.inleading = self.exleading = 0
+		self.pointsize = None
+		self.stride = 0
+		self.widths = array.array("H", bytes(2 * NCHARS))
+		self.bits = bytearray()
+
+	def reset(self, height, stride=0):
+		"Set the height and clear all glyphs to zero width."
+		self.height = height
+		self.stride = stride
+		self.widths = array.array("H", bytes(2 * NCHARS))
+		self.bits = bytearray(NCHARS * height * stride)
+
+	@property
+	def glyphsize(self):
+		return self.height * self.stride
+
+	@property
+	def chars(self):
+		return GlyphTable(self)
+
+	def restride(self, stride):
+		"Re-lay the bitmap store with a different number of bytes per row."
+		if stride != self.stride:
+			self.bits = bytearray(winbitmap.restride(self.bits,
+				NCHARS * self.height, self.stride, stride))
+			self.stride = stride
+
+	def bitmap(self, stride):
+		"Return the bitmap store laid out with the given bytes per row."
+		if stride == self.stride:
+			return self.bits
+		return winbitmap.restride(self.bits, NCHARS * self.height,
+			self.stride, stride)
+
+	def clip(self, i):
+		"Clear any bits of glyph i lying to the right of its width."
+		width = self.widths[i]
+		stride = self.stride
+		base = i * self.glyphsize
+		end = base + self.glyphsize
+		k = width // 8
+		if width % 8 and k < stride:
+			column = self.bits[base+k:end:stride]
+			self.bits[base+k:end:stride] = column.translate(clipmasks[width % 8])
+			k = k + 1
+		for k in range(k, stride):
+			self.bits[base+k:end:stride] = bytes(self.height)
+
+	def clipall(self, width):
+		"""Clear any bits lying to the right of width in every glyph at
+		once, as for a fixed-pitch font."""
+		stride = self.stride
+		k = width // 8
+		if width % 8 and k < stride:
+			self.bits[k::stride] = self.bits[k::stride].translate(
+				clipmasks[width % 8])
+			k = k + 1
+		for k in range(k, stride):
+			self.bits[k::stride] = bytes(len(self.bits) // stride)
+
+class GlyphTable:
+	"The sequence of glyph handles of a Font."
+	__slots__ = ("font",)
+
+	def __init__(self, font):
+		self.font = font
+
+	def __len__(self):
+		return NCHARS
+
+	def __getitem__(self, i):
+		if i < 0:
+			i = i + NCHARS
+		if i < 0 or i >= NCHARS:
+			raise IndexError("glyph index out of range")
+		return Glyph(self.font, i)
+
+class Glyph:
+	"A handle on one glyph in a Font's shared store."
+	__slots__ = ("font", "index")
+
+	def __init__(self, font, index):
+		self.font = font
+		self.index = index
+
+	@property
+	def width(self):
+		return self.font.widths[self.index]
+
+	@width.setter
+	def width(self, width):
+		f = self.font
+		if width > 8 * f.stride:
+			f.restride(widthbytes(width))
+		f.widths[self.index] = width
+		f.clip(self.index)
+
+	@property
+	def rows(self):
+		"A memoryview of this glyph's row-major bitmap."
+		f = self.font
+		base = self.index * f.glyphsize
+		return memoryview(f.bits)[base:base+f.glyphsize]
+
+	@property
+	def data(self):
+		"The glyph's rows as a list of integers, width bits each."
+		f = self.font
+		return winbitmap.unpackrows(f.bits, f.widths[self.index], f.stride,
+			self.index * f.glyphsize, f.height)
+
+	@data.setter
+	def data(self, data):
+		f = self.font
+		if len(data) != f.height:
+			raise ValueError("Glyph needs %d rows, not %d" % (f.height,
+				len(data)))
+		base = self.index * f.glyphsize
+		f.bits[base:base+f.glyphsize] = winbitmap.packrows(data,
+			f.widths[self.index], f.stride)
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+
+# Packed binary font descriptions, for passing fonts between programs.
+#
+# A .fdb file holds what a .fd file does, but as the in-memory
+# winfontmodel.Font lays it out, so loading one is a header unpack and
+# two block copies rather than a parse of every glyph row:
+#
+#   0x00  header (below), 64 bytes
+#   0x40  256 glyph widths, 16-bit little-endian
+#   0x240 the bitmap store: 256 glyphs of height rows of stride bytes,
+#         row-major, leftmost pixel in the top bit, bits beyond each
+#         glyph's width zero
+#   then  the face name and copyright, UTF-8, not terminated
+#
+# Every block starts at a fixed, 64-byte aligned offset given in the
+# header, so a reader can also map the file and use the widths and
+# bitmaps where they lie. The version is bumped whenever the layout
+# changes; readers refuse versions newer than their own.
+#
+# usage: winfontpack file.fd outfile.fdb
+#        winfontpack file.fdb outfile.fd
+# converts between the two forms (mkwinfont and dewinfont also read
+# and write .fdb directly).
+
+import array
+import mmap
+import struct
+import sys
+
+from winfontmodel import Font, FontError, NCHARS
+
+magic = b"WINFONT\x1a"
+packversion = 1
+
+# magic, version, flags (none yet), height, stride, ascent, point size,
+# internal and external leading, weight, charset, italic, underline,
+# strikeout, offsets of the widths, bitmaps and strings, size of the
+# bitmaps, and lengths of the face name and copyright.
+header = struct.Struct("<8sHHHHHHHHHBBBBLLLLHH14x")
+assert header.size == 0x40
+
+def ispacked(data):
+	"Determine if some data is a packed font."
+	return bytes(data[:len(magic)]) == magic
+
+def dump(f):
+	"Return the packed form of a Font."
+	widths = array.array("H", f.widths)
+	if sys.byteorder == "big":
+		widths.byteswap()
+	facename = f.facename.encode("utf-8")
+	copyright = (f.copyright or "").encode("utf-8")
+	widthsoff = header.size
+	bitsoff = widthsoff + 2 * NCHARS
+	stringsoff = (bitsoff + len(f.bits) + 63) &~ 63
+	out = bytearray(stringsoff + len(facename) + len(copyright))
+	header.pack_into(out, 0, magic, packversion, 0, f.height, f.stride,
+		f.ascent, f.pointsize, f.inleading, f.exleading, f.weight,
+		f.charset & 0xFF, int(f.italic), int(f.underline), int(f.strikeout),
+		widthsoff, bitsoff, stringsoff, len(f.bits), len(facename),
+		len(copyright))
+	out[widthsoff:bitsoff] = widths.tobytes()
+	out[bitsoff:bitsoff+len(f.bits)] = f.bits
+	out[stringsoff:] = facename + copyright
+	return bytes(out)
+
+def load(data):
+	"Make a Font from a packed font. Raises FontError if it isn't one."
+	data = memoryview(data)
+	if len(data) < header.size or not ispacked(data):
+		raise FontError("Not a packed font")
+	(m, version, flags, height, stride, ascent, pointsize, inleading,
+		exleading, weight, charset, italic, underline, strikeout, widthsoff,
+		bitsoff, stringsoff, bitssize, namelen,
+		copyrightlen) = header.unpack_from(data)
+	if version > packversion:
+		raise FontError("Packed font is version %d; this reads only up "
+			"to version %d" % (version, packversion))
+	if bitssize != NCHARS * height * stride:
+		raise FontError("Packed font bitmap size doesn't match its header")
+	if widthsoff + 2 * NCHARS > len(data) or bitsoff + bitssize > len(data) \
+		or stringsoff + namelen + copyrightlen > len(data):
+		raise FontError("Packed font truncated")
+	f = Font()
+	f.height = height
+	f.stride = stride
+	f.ascent = ascent
+	f.pointsize = pointsize
+	f.inleading = inleading
+	f.exleading = exleading
+	f.weight = weight
+	f.charset = charset
+	f.italic = italic != 0
+	f.underline = underline != 0
+	f.strikeout = strikeout != 0
+	f.widths = array.array("H")
+	f.widths.frombytes(data[widthsoff:widthsoff+2*NCHARS])
+	if sys.byteorder == "big":
+		f.widths.byteswap()
+	if max(f.widths) > 8 * stride:
+		raise FontError("Packed font has glyphs wider than its rows")
+	f.bits = bytearray(data[bitsoff:bitsoff+bitssize])
+	p = stringsoff
+	f.facename = str(data[p:p+namelen], encoding="utf-8")
+	p = p + namelen
+	f.copyright = str(data[p:p+copyrightlen], encoding="utf-8")
+	return f
+
+def loadfile(fname):
+	"Load a packed font file. Raises FontError if it isn't one."
+	fp = open(fname, "rb")
+	try:
+		try:
+			data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+		except (ValueError, OSError):
+			data = fp.read()
+		try:
+			return load(data)
+		except FontError as e:
+			raise FontError("%s: %s" % (fname, e))
+	finally:
+		fp.close()
+
+def savefile(f, fname):
+	"Write a Font out as a packed font file."
+	fp = open(fname, "wb")
+	fp.write(dump(f))
+	fp.close()
+
+if __name__ == "__main__":
+	if len(sys.argv) != 3:
+		print("usage: winfontpack file.fd outfile.fdb")
+		print("       winfontpack file.fdb outfile.fd")
+		sys.exit(0)
+	import mkwinfont
+	import dewinfont
+	try:
+		f = mkwinfont.loadfont(sys.argv[1])
+		if sys.argv[2].lower().endswith(".fdb"):
+			savefile(f, sys.argv[2])
+		else:
+			fp = open(sys.argv[2], "w")
+			dewinfont.savefont(f, fp)
+			fp.close()
+	except (ValueError, OSError) as e:
+		sys.stderr.write(str(e)+"\n")
+		sys.exit(1)
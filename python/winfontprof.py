@@ -0,0 +1,168 @@
+# Stage timers and counters for mkwinfont and dewinfont.
+#
+# enable() wraps the functions that do each stage of the work:
+#
+#   parse    mkwinfont.parsefont    .fd text to a Font
+#   encode   mkwinfont.fnt          Font to .FNT data
+#   link     mkwinfont.fon, and FonWriter.add and close
+#   read     dewinfont.readfile     mapping an input file
+#   locate   dewinfont.findfonts    walking a .FON's resource table
+#   decode   dewinfont.fntfont      .FNT data to a Font
+#   format   dewinfont.savefont     Font to .fd text
+#
+# so that each call reports its stage, the time it took and a few
+# counters (glyphs processed, bytes in, bytes emitted, bytes copied
+# from one buffer to another) to every hook: any callable taking
+# (stage, seconds, counters). A Profile is a hook that totals them up.
+# Until enable() is called nothing is wrapped, so the tools pay nothing
+# for this; disable() puts the original functions back.
+#
+# The tools' -profile option prints a Profile's breakdown on stderr
+# when they finish, and -pstats file writes a cProfile of the whole run
+# for pstats or snakeviz.
+
+import atexit
+import collections
+import sys
+import time
+
+def glyphs(f):
+	return len(f.widths) - f.widths.count(0)
+
+# For each wrapped function: its stage, and how to count what a call
+# did given its arguments and result.
+stages = {
+	"parsefont": ("parse", lambda args, r: {"glyphs": glyphs(r)}),
+	"fnt": ("encode", lambda args, r: {"glyphs": glyphs(args[0]),
+		"bytes out": len(r)}),
+	"fon": ("link", lambda args, r: {"fonts": len(args[1]),
+		"bytes copied": sum([len(f) for f in args[1]]), "bytes out": len(r)}),
+	"FonWriter.add": ("link", lambda args, r: {"fonts": 1,
+		"bytes copied": len(args[1])}),
+	"FonWriter.close": ("link", lambda args, r: {"bytes out": r}),
+	"readfile": ("read", lambda args, r: {"bytes in": len(r)}),
+	"findfonts": ("locate", lambda args, r: {"fonts": len(r)}),
+	"fntfont": ("decode", lambda args, r: {"glyphs": glyphs(r),
+		"bytes in": len(args[0])}),
+	"savefont": ("format", lambda args, r: {"glyphs": glyphs(args[0])}),
+}
+
+hooks = []
+# (object, attribute, original) for everything wrapped.
+wrapped = []
+
+def wrap(fn, stage, count):
+	def timed(*args, **kwargs):
+		t = time.perf_counter()
+		result = fn(*args, **kwargs)
+		t = time.perf_counter() - t
+		counters = count(args, result)
+		for hook in hooks:
+			hook(stage, t, counters)
+		return result
+	timed.__name__ = fn.__name__
+	timed.__doc__ = fn.__doc__
+	timed.__wrapped__ = fn
+	return timed
+
+def enable(hook, *modules):
+	"""Start passing stage timings to a hook, from the given modules, or
+	from mkwinfont and dewinfont if none are given."""
+	if not modules:
+		import dewinfont
+		import mkwinfont
+		modules = (mkwinfont, dewinfont)
+	hooks.append(hook)
+	done = set([(id(obj), name) for obj, name, fn in wrapped])
+	for module in modules:
+		for name, (stage, count) in stages.items():
+			obj = module
+			attr = name
+			if "." in name:
+				cls, attr = name.split(".")
+				obj = getattr(module, cls, None)
+			if obj == None or not hasattr(obj, attr) or \
+				(id(obj), attr) in done:
+				continue
+			fn = getattr(obj, attr)
+			wrapped.append((obj, attr, fn))
+			setattr(obj, attr, wrap(fn, stage, count))
+
+def disable():
+	"Remove every hook and put the original functions back."
+	while wrapped:
+		obj, attr, fn = wrapped.pop()
+		setattr(obj, attr, fn)
+	del hooks[:]
+
+class Profile:
+	"A hook that totals up the calls, time and counters of each stage."
+
+	def __init__(self):
+		self.calls = collections.Counter()
+		self.seconds = collections.Counter()
+		self.counters = {}
+		self.start = time.perf_counter()
+
+	def __call__(self, stage, seconds, counters):
+		self.calls[stage] = self.calls[stage] + 1
+		self.seconds[stage] = self.seconds[stage] + seconds
+		if stage not in self.counters:
+			self.counters[stage] = collections.Counter()
+		self.counters[stage].update(counters)
+
+	def report(self):
+		"Return the breakdown by stage, as text."
+		elapsed = time.perf_counter() - self.start
+		lines = ["%-8s %7s %10s %7s  %s" % ("stage", "calls", "seconds",
+			"share", "counters")]
+		order = [s for s in ("parse", "encode", "link", "read", "locate",
+			"decode", "format") if s in self.calls]
+		for stage in order + sorted(set(self.calls) - set(order)):
+			counters = ", ".join(["%s %d" % (k, v) for k, v in
+				sorted(self.counters[stage].items())])
+			lines.append("%-8s %7d %10.4f %6.1f%%  %s" % (stage,
+				self.calls[stage], self.seconds[stage],
+				100.0 * self.seconds[stage] / elapsed if elapsed > 0 else 0,
+				counters))
+		rest = elapsed - sum(self.seconds.values())
+		lines.append("%-8s %7s %10.4f %6.1f%%" % ("other", "", rest,
+			100.0 * rest / elapsed if elapsed > 0 else 0))
+		lines.append("%-8s %7s %10.4f" % ("total", "", elapsed))
+		return "\n".join(lines)
+
+def fromargs(a, *modules):
+	"""Take -profile and -pstats file out of a command line and start
+	profiling the given modules as they ask; the results are reported
+	at exit. Returns the rest of the command line. Raises ValueError if
+	-pstats has no argument."""
+	rest = []
+	profile = None
+	pstats = None
+	while len(a) > 0:
+		if a[0] == "--":
+			rest = rest + a
+			break
+		if a[0] in ("-profile", "--profile"):
+			profile = Profile()
+			a = a[1:]
+		elif a[0] == "-pstats":
+			if len(a) < 2:
+				raise ValueError("option -pstats requires an argument")
+			pstats = a[1]
+			a = a[2:]
+		else:
+			rest.append(a[0])
+			a = a[1:]
+	if profile != None:
+		enable(profile, *modules)
+		atexit.register(lambda: sys.stderr.write(profile.report() + "\n"))
+	if pstats != None:
+		import cProfile
+		p = cProfile.Profile()
+		p.enable()
+		def dump():
+			p.disable()
+			p.dump_stats(pstats)
+		atexit.register(dump)
+	return rest
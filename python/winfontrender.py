@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+
+# Render text in a bitmap font into 1- or 8-bit-per-pixel images.
+#
+# A Renderer takes a decoded winfontmodel.Font (from dewinfont.dofnt
+# or mkwinfont.loadfont) and builds its glyph atlas once: for each
+# pixel row, a str.translate table mapping every char to that row of
+# its glyph as a string of "0"s and "1"s, width characters long (empty
+# for chars the font leaves blank). Rendering a run is then one
+# translate per row, done in C, after which each row is packed to bits
+# with int(row, 2) or mapped to bytes with bytes.translate. Fixed- and
+# proportional-pitch fonts take the same path.
+#
+# When NumPy is installed (it is imported when the first Renderer is
+# built, not when this module is) the atlas is also kept as an array
+# of glyph pixels, one byte each, and a run is drawn by gathering its
+# glyphs from that, dropping the columns past each glyph's width, and
+# packing with numpy.packbits.
+#
+# Rendered runs are kept in a small LRU cache, since a pipeline tends
+# to draw the same labels over and over.
+#
+# usage: winfontrender [-n index] [-8] -o outfile file text
+# writes text rendered in the font in file (.fd, .fdb, .fnt or .fon;
+# -n picks a font from a .fon) as a PBM, or with -8 as a PGM.
+
+import collections
+import sys
+
+import winbitmap
+
+# The eight pixels of each possible bitmap byte, as "0"s and "1"s.
+bitstr = [format(b, "08b") for b in range(256)]
+
+class Image:
+	"A rendered bitmap: height rows of stride bytes, bpp 1 or 8."
+	__slots__ = ("width", "height", "bpp", "stride", "data")
+
+	def __init__(self, width, height, bpp, data):
+		self.width = width
+		self.height = height
+		self.bpp = bpp
+		if bpp == 1:
+			self.stride = (width + 7) // 8
+		else:
+			self.stride = width
+		self.data = data
+
+	def row(self, y):
+		"Return the bytes of row y."
+		return self.data[y*self.stride:(y+1)*self.stride]
+
+	def pnm(self):
+		"Return the image as a binary PBM (bpp 1) or PGM (bpp 8) file."
+		if self.bpp == 1:
+			head = "P4\n%d %d\n" % (self.width, self.height)
+		else:
+			head = "P5\n%d %d\n255\n" % (self.width, self.height)
+		return head.encode("ascii") + self.data
+
+class Renderer:
+	"Renders strings in one font, with a cache of recently drawn runs."
+
+	def __init__(self, font, cachesize=1024, fg=255, bg=0):
+		"""Build the glyph atlas for a Font. 8-bpp images use fg for ink
+		and bg for paper; cachesize is the number of runs remembered."""
+		self.font = font
+		self.height = font.height
+		self.widths = [font.widths[i] for i in range(256)]
+		self.ink = bytes.maketrans(b"01", bytes([bg, fg]))
+		self.cachesize = cachesize
+		self.cache = collections.OrderedDict()
+		self.hits = self.misses = 0
+		# One translate table per row; every char maps to something, so
+		# that none is passed through unchanged.
+		stride = font.stride
+		size = font.glyphsize
+		self.atlas = [{} for y in range(font.height)]
+		for i in range(256):
+			width = font.widths[i]
+			for y in range(font.height):
+				p = i*size + y*stride
+				row = "".join([bitstr[b] for b in font.bits[p:p+stride]])
+				self.atlas[y][i] = row[:width]
+		self.pixels = None
+		numpy = winbitmap.havenumpy()
+		if numpy is not None and font.height > 0 and stride > 0:
+			bits = numpy.frombuffer(bytes(font.bits), dtype=numpy.uint8)
+			bits = numpy.unpackbits(bits.reshape(256, font.height, stride), axis=2)
+			# A fixed-pitch font needs only its glyphs' own columns; any
+			# other font keeps a mask of which columns each glyph uses.
+			self.fixed = min(self.widths) == max(self.widths)
+			if self.fixed:
+				bits = bits[:, :, :self.widths[0]]
+			else:
+				self.columns = numpy.arange(8*stride) < \
+					numpy.array(self.widths)[:, None]
+			self.pixels = numpy.ascontiguousarray(bits.transpose(1, 0, 2))
+			lut = numpy.frombuffer(bytes([bg, fg]), dtype=numpy.uint8)
+			self.grey = lut[self.pixels]
+
+	def codes(self, text):
+		"""Return text as a str of glyph indices: bytes are taken as they
+		are, and a str is encoded as Latin-1, unencodable chars becoming
+		"?"."""
+		if isinstance(text, str):
+			text = text.encode("latin-1", errors="replace")
+		return str(text, encoding="latin-1")
+
+	def measure(self, text):
+		"Return the width in pixels of a run of text."
+		return sum(map(self.widths.__getitem__, self.codes(text).encode("latin-1")))
+
+	def render(self, text, bpp=1):
+		"Render a run of text into an Image, packed 1 or 8 bits per pixel."
+		if bpp not in (1, 8):
+			raise ValueError("bpp must be 1 or 8")
+		text = self.codes(text)
+		key = (text, bpp)
+		image = self.cache.get(key)
+		if image != None:
+			self.cache.move_to_end(key)
+			self.hits = self.hits + 1
+			return image
+		self.misses = self.misses + 1
+		image = self.draw(text, bpp)
+		self.cache[key] = image
+		if len(self.cache) > self.cachesize:
+			self.cache.popitem(last=False)
+		return image
+
+	def draw(self, text, bpp):
+		if self.pixels is not None and len(text) > 0:
+			return self.drawarray(text, bpp)
+		rows = [text.translate(t) for t in self.atlas]
+		width = len(rows[0]) if rows else 0
+		if width == 0:
+			return Image(0, self.height, bpp, b"")
+		if bpp == 1:
+			stride = (width + 7) // 8
+			pad = 8*stride - width
+			data = b"".join([(int(r, 2) << pad).to_bytes(stride, "big")
+				for r in rows])
+		else:
+			data = "".join(rows).encode("ascii").translate(self.ink)
+		return Image(width, self.height, bpp, data)
+
+	def drawarray(self, text, bpp):
+		numpy = winbitmap.havenumpy()
+		codes = numpy.frombuffer(text.encode("latin-1"), dtype=numpy.uint8)
+		if bpp == 1:
+			pixels = self.pixels
+		else:
+			pixels = self.grey
+		rows = pixels.take(codes, axis=1).reshape(self.height, -1)
+		if not self.fixed:
+			rows = rows.compress(self.columns[codes].ravel(), axis=1)
+		width = rows.shape[1]
+		if bpp == 1:
+			data = numpy.packbits(rows, axis=1).tobytes()
+		else:
+			data = rows.tobytes()
+		return Image(width, self.height, bpp, data)
+
+def loadany(fname, index=0):
+	"""Load font number index from a .fd, .fdb, .fnt or .fon file, or
+	return None."""
+	if fname.lower().endswith((".fd", ".fdb")):
+		import mkwinfont
+		return mkwinfont.loadfont(fname)
+	import dewinfont
+	fonts = dewinfont.decompile(dewinfont.readfile(fname))
+	if fonts == None or index >= len(fonts):
+		return None
+	return fonts[index]
+
+if __name__ == "__main__":
+	a = sys.argv[1:]
+	outfile = None
+	index = 0
+	bpp = 1
+	args = []
+	if len(a) == 0:
+		print("usage: winfontrender [-n index] [-8] -o outfile file text")
+		sys.exit(0)
+	try:
+		while len(a) > 0:
+			if a[0] in ("-o", "-n"):
+				if len(a) < 2:
+					raise ValueError("option "+a[0]+" requires an argument")
+				if a[0] == "-o":
+					outfile = a[1]
+				else:
+					index = int(a[1])
+				a = a[2:]
+			elif a[0] == "-8":
+				bpp = 8
+				a = a[1:]
+			elif a[0] == "--":
+				args = args + a[1:]
+				a = []
+			else:
+				args = args + [a[0]]
+				a = a[1:]
+		if outfile == None:
+			raise ValueError("no output file specified")
+		if len(args) != 2:
+			raise ValueError("need a font file and some text")
+		font = loadany(args[0], index)
+	except (ValueError, OSError) as e:
+		sys.stderr.write(str(e)+"\n")
+		sys.exit(1)
+	if font == None:
+		sys.stderr.write("unable to read font from "+args[0]+"\n")
+		sys.exit(1)
+
+	fp = open(outfile, "wb")
+	fp.write(Renderer(font).render(args[1], bpp).pnm())
+	fp.close()
@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+
+# Structural comparison of fonts, for checking what mkwinfont built.
+#
+# Rather than decompiling a font and diffing .fd text, this compares
+# two winfontmodel.Font objects (from mkwinfont.loadfont or
+# dewinfont.dofnt) directly. A digest of each whole font (header
+# fields, widths and bitmap store) is checked first, so identical fonts
+# cost a hash apiece; only when those differ are the header fields
+# compared one by one and each glyph hashed to find the ones that
+# differ, and only for those are rows compared.
+#
+# usage: winfontverify file file [file ...]
+# compares the fonts in the first file (.fd, .fdb, .fnt or .fon) with
+# those in the rest, taken in order, e.g. a built .fon against the .fd
+# files it was built from. Prints the differences, and exits with
+# status 1 if there are any.
+
+import hashlib
+import sys
+
+from winfontmodel import NCHARS, widthbytes as rowbytes
+
+fields = ("facename", "copyright", "pointsize", "height", "ascent",
+	"inleading", "exleading", "italic", "underline", "strikeout", "weight",
+	"charset")
+
+def header(f):
+	"Return a font's header fields as a tuple, in the order of fields."
+	return tuple([int(getattr(f, k)) if k in ("italic", "underline",
+		"strikeout") else getattr(f, k) for k in fields])
+
+def canonical(f):
+	"""Return a font's bitmap store at the stride its widest glyph needs,
+	which is how both mkwinfont and dewinfont lay it out."""
+	return f.bitmap(rowbytes(max(f.widths)))
+
+def digest(f):
+	"Return a digest of everything about a font that verify compares."
+	h = hashlib.blake2b(digest_size=16)
+	h.update(repr(header(f)).encode("utf-8"))
+	h.update(f.widths.tobytes())
+	h.update(canonical(f))
+	return h.digest()
+
+def glyphdigests(f, stride, bits):
+	"""Return a digest of each glyph's width and rows, given the font's
+	bitmap store at some stride. Fonts compared this way must be given
+	at the same stride."""
+	bits = memoryview(bits)
+	size = stride * f.height
+	widths = f.widths
+	blake2b = hashlib.blake2b
+	return [blake2b(bits[i*size:(i+1)*size], digest_size=16,
+		salt=widths[i].to_bytes(2, "little")).digest() for i in range(NCHARS)]
+
+def diff(a, b):
+	"""Compare two fonts. Returns a list of differences, one string
+	each, which is empty if they are the same."""
+	if digest(a) == digest(b):
+		return []
+	out = []
+	ha = header(a)
+	hb = header(b)
+	for k in range(len(fields)):
+		if ha[k] != hb[k]:
+			out.append("%s: %r != %r" % (fields[k], ha[k], hb[k]))
+	if a.height != b.height:
+		# Glyphs of different heights can't be compared row by row.
+		return out
+	stride = max(rowbytes(max(a.widths)), rowbytes(max(b.widths)))
+	ba = a.bitmap(stride)
+	bb = b.bitmap(stride)
+	da = glyphdigests(a, stride, ba)
+	db = glyphdigests(b, stride, bb)
+	size = stride * a.height
+	for i in range(NCHARS):
+		if da[i] == db[i]:
+			continue
+		if a.widths[i] != b.widths[i]:
+			out.append("char %d: width %d != %d" % (i, a.widths[i],
+				b.widths[i]))
+			continue
+		base = i * size
+		rows = [y for y in range(a.height) if
+			ba[base+y*stride:base+(y+1)*stride] !=
+			bb[base+y*stride:base+(y+1)*stride]]
+		if not rows:
+			continue
+		out.append("char %d: row%s %s differ" % (i, "s" if len(rows) > 1
+			else "", ", ".join(["%d" % y for y in rows])))
+	return out
+
+def difffonts(a, b):
+	"""Compare two lists of fonts, pairwise. Returns a list of
+	differences, each prefixed with the index of the font pair."""
+	out = []
+	if len(a) != len(b):
+		out.append("%d fonts != %d fonts" % (len(a), len(b)))
+	for i in range(min(len(a), len(b))):
+		out = out + ["font %d: %s" % (i, d) for d in diff(a[i], b[i])]
+	return out
+
+def loadfonts(fname):
+	"""Load every font in a .fd, .fdb, .fnt or .fon file. Raises ValueError
+	(or mkwinfont.FDError) if that can't be done."""
+	if fname.lower().endswith((".fd", ".fdb")):
+		import mkwinfont
+		return [mkwinfont.loadfont(fname)]
+	import dewinfont
+	fonts = dewinfont.decompile(dewinfont.readfile(fname))
+	if fonts == None:
+		raise ValueError("unable to read fonts from "+fname)
+	return fonts
+
+if __name__ == "__main__":
+	if len(sys.argv) < 3:
+		print("usage: winfontverify file file [file ...]")
+		sys.exit(0)
+	try:
+		a = loadfonts(sys.argv[1])
+		b = []
+		for fname in sys.argv[2:]:
+			b = b + loadfonts(fname)
+	except (ValueError, OSError) as e:
+		sys.stderr.write(str(e)+"\n")
+		sys.exit(1)
+	out = difffonts(a, b)
+	for d in out:
+		print(d)
+	if out:
+		sys.exit(1)